@@ -0,0 +1,104 @@
+import json
+import os
+from collections import OrderedDict
+
+# On-disk asset cache, next to tracker.db
+ASSET_CACHE_FILENAME = "assets.json"
+
+# Assets kept in the cache; the least recently used ones are evicted first
+ASSET_CACHE_SIZE = 5000
+
+# Policy ids of the reward tokens
+INDY_POLICY = "533bb94a8850ee3ccbe483106489399112b74c905342cb1792a797a0"
+STUFF_POLICY = "51a5e236c4de3af2b8020442e2a26f454fda3b04cb621c1294a0ef34"  # Book.io's BOOK, now Stuff.io's STUFF
+
+# dbsync has no token decimals, so they are declared here by (policy id, asset
+# name); a None name covers every asset of the policy. Unlisted assets keep
+# their raw on-chain quantity.
+ASSET_DECIMALS = {
+    (INDY_POLICY, 'INDY'): 6,
+    (STUFF_POLICY, None): 6,
+}
+
+ADA_DECIMALS = 6
+
+# multi_asset.id -> (policy, name, decimals), shared by every lookup in the process
+_registry = OrderedDict()
+_loaded_from = None
+
+def asset_name(name_hex):
+    """Readable asset name: the UTF-8 text of the name when printable, else its hex."""
+    try:
+        name = bytes.fromhex(name_hex).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return name_hex
+    return name if name.isprintable() else name_hex
+
+def load_cache(filename=ASSET_CACHE_FILENAME):
+    """Load the on-disk asset cache into the registry, once per file."""
+    global _loaded_from
+    if _loaded_from == filename:
+        return
+    _loaded_from = filename
+    try:
+        with open(filename, 'r') as file:
+            entries = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return
+    # Decimals come from ASSET_DECIMALS as it is now, not as it was when cached
+    for ident, policy, name, _ in entries:
+        _registry.setdefault(int(ident), (policy, name, asset_decimals(policy, name)))
+
+def save_cache(filename=ASSET_CACHE_FILENAME, size=ASSET_CACHE_SIZE):
+    """Write the most recently used assets of the registry to the on-disk cache."""
+    while len(_registry) > size:
+        _registry.popitem(last=False)
+    temp_filename = f"{filename}.tmp"
+    with open(temp_filename, 'w') as file:
+        json.dump([[ident, *asset] for ident, asset in _registry.items()], file)
+    os.replace(temp_filename, filename)
+
+MULTI_ASSET_QUERY = """
+SELECT id, encode(policy, 'hex'), encode(name, 'hex')
+FROM multi_asset
+WHERE id = ANY(%s);
+"""
+
+def asset_decimals(policy, name):
+    """Decimals of an asset, 0 when not declared in ASSET_DECIMALS."""
+    return ASSET_DECIMALS.get((policy, name), ASSET_DECIMALS.get((policy, None), 0))
+
+def missing_assets(idents, filename=ASSET_CACHE_FILENAME):
+    """The multi_asset ids not in the registry (or its on-disk cache) yet."""
+    load_cache(filename)
+    return [ident for ident in set(idents) if ident not in _registry]
+
+def register_assets(rows):
+    """Add (id, policy hex, name hex) MULTI_ASSET_QUERY rows to the registry."""
+    for ident, policy, name_hex in rows:
+        name = asset_name(name_hex)
+        _registry[ident] = (policy, name, asset_decimals(policy, name))
+
+def cached_assets(idents):
+    """Dict of multi_asset.id -> (policy, name, decimals) for the registered ids."""
+    assets = {}
+    for ident in idents:
+        if ident in _registry:
+            _registry.move_to_end(ident)
+            assets[ident] = _registry[ident]
+    return assets
+
+def resolve_assets(cursor, idents, filename=ASSET_CACHE_FILENAME):
+    """Dict of multi_asset.id -> (policy, name, decimals), only querying the ids not cached yet."""
+    missing = missing_assets(idents, filename)
+    if missing:
+        cursor.execute(MULTI_ASSET_QUERY, (missing,))
+        register_assets(cursor.fetchall())
+    assets = cached_assets(idents)
+    if missing:
+        save_cache(filename)
+    return assets
+
+def scaled_amount(quantity, decimals):
+    """Integer on-chain quantity scaled by decimals, as a float."""
+    return int(quantity) / 10 ** decimals
@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+
+import assets
+import db as database
+import find_txs
+import index_advisor
+import rewards_engine
+
+# Database the synthetic schema is built in; it is created when missing
+BENCH_DBNAME = "tracker_bench"
+
+RESULTS_FILENAME = "benchmark.json"
+
+# Minimal cexplorer-compatible schema: the tables and columns the tracker queries
+SCHEMA = """
+DROP TABLE IF EXISTS withdrawal, stake_address, ma_tx_mint, ma_tx_out, multi_asset, tx_in, tx_out, tx, block;
+CREATE TABLE block (id bigint PRIMARY KEY, hash bytea NOT NULL UNIQUE, slot_no bigint, time timestamp NOT NULL);
+CREATE TABLE tx (id bigint PRIMARY KEY, hash bytea NOT NULL UNIQUE, block_id bigint NOT NULL);
+CREATE TABLE tx_out (id bigint PRIMARY KEY, tx_id bigint NOT NULL, index smallint NOT NULL,
+                     address varchar NOT NULL, value numeric NOT NULL, stake_address_id bigint);
+CREATE TABLE tx_in (id bigint PRIMARY KEY, tx_in_id bigint NOT NULL, tx_out_id bigint NOT NULL,
+                    tx_out_index smallint NOT NULL);
+CREATE TABLE multi_asset (id bigint PRIMARY KEY, policy bytea NOT NULL, name bytea NOT NULL, fingerprint varchar);
+CREATE TABLE ma_tx_out (id bigint PRIMARY KEY, ident bigint NOT NULL, quantity numeric NOT NULL,
+                        tx_out_id bigint NOT NULL);
+CREATE TABLE ma_tx_mint (id bigint PRIMARY KEY, ident bigint NOT NULL, quantity numeric NOT NULL, tx_id bigint NOT NULL);
+CREATE TABLE stake_address (id bigint PRIMARY KEY, view varchar NOT NULL);
+CREATE TABLE withdrawal (id bigint PRIMARY KEY, addr_id bigint NOT NULL, amount numeric NOT NULL, tx_id bigint NOT NULL);
+"""
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor recording the latency of every statement it runs."""
+
+    latencies = []
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        finally:
+            TimedCursor.latencies.append(time.perf_counter() - started)
+
+def bench_connect(dbname, cursor_factory=None):
+    """Connection to the benchmark database with the shared settings."""
+    kwargs = database.connect_kwargs()
+    kwargs['dbname'] = dbname
+    return psycopg2.connect(connection_factory=database.PreparingConnection, cursor_factory=cursor_factory, **kwargs)
+
+def ensure_database(dbname):
+    """Create the benchmark database when it does not exist yet."""
+    kwargs = database.connect_kwargs()
+    kwargs['dbname'] = 'postgres'
+    conn = psycopg2.connect(**kwargs)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;", (dbname,))
+            if not cur.fetchone():
+                cur.execute(f'CREATE DATABASE "{dbname}";')
+    finally:
+        conn.close()
+
+def is_dbsync_database(dbname):
+    """True when the database has db-sync's schema_version table, i.e. holds a real chain."""
+    conn = bench_connect(dbname)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def bench_wallets(count):
+    """Addresses of the synthetic wallets."""
+    return [f"addr_test1bench{index:04d}" for index in range(count)]
+
+def generate_data(wallets, txs, payouts, asset_count, noise, seed):
+    """Synthetic rows of every table, plus the wallet addresses, built from a seeded generator."""
+    rng = random.Random(seed)
+    rows = {table: [] for table in ('block', 'tx', 'tx_out', 'tx_in', 'multi_asset', 'ma_tx_out', 'ma_tx_mint')}
+    ids = {table: 0 for table in rows}
+    started = datetime(2023, 1, 1)
+
+    def next_id(table):
+        ids[table] += 1
+        return ids[table]
+
+    def new_tx():
+        block_id = next_id('block')
+        rows['block'].append((block_id, rng.randbytes(32), block_id * 20, started + timedelta(seconds=block_id * 20)))
+        tx_id = next_id('tx')
+        rows['tx'].append((tx_id, rng.randbytes(32), block_id))
+        return tx_id
+
+    def add_output(tx_id, index, address, value, tokens=()):
+        tx_out_id = next_id('tx_out')
+        rows['tx_out'].append((tx_out_id, tx_id, index, address, value, None))
+        for ident, quantity in tokens:
+            rows['ma_tx_out'].append((next_id('ma_tx_out'), ident, quantity, tx_out_id))
+        return (tx_id, index)
+
+    def add_input(tx_id, spent):
+        rows['tx_in'].append((next_id('tx_in'), tx_id, *spent))
+
+    # The first assets are the reward tokens of the sources, under their policy, the rest are noise
+    token_policies = {source['asset']: bytes.fromhex(source['policy'])
+                      for source in rewards_engine.REWARD_SOURCES.values() if source['asset'] != 'ADA'}
+    token_names = list(token_policies)
+    token_names += [f"TOKEN{index}" for index in range(max(asset_count - len(token_names), 0))]
+    for name in token_names:
+        ident = next_id('multi_asset')
+        rows['multi_asset'].append((ident, token_policies.get(name) or rng.randbytes(28), name.encode(), f"asset{ident}"))
+        rows['ma_tx_mint'].append((next_id('ma_tx_mint'), ident, 10 ** 12, new_tx()))
+    reward_tokens = {name: ident for ident, name in enumerate(token_names, 1)}
+
+    sources = [name for name, source in rewards_engine.REWARD_SOURCES.items()
+               if rewards_engine.source_method(name) == 'outputs']
+    source_addresses = {name: rewards_engine.read_addresses(rewards_engine.source_addresses_file(name))[0]
+                        for name in sources}
+
+    wallet_addresses = bench_wallets(wallets)
+    unspent = {address: [] for address in wallet_addresses}
+    for address in wallet_addresses:
+        payout_at = set(rng.sample(range(txs), min(payouts, txs)))
+        for index in range(txs):
+            tx_id = new_tx()
+            if index in payout_at:
+                name = rng.choice(sources)
+                source = rewards_engine.REWARD_SOURCES[name]
+                tokens = [(reward_tokens[source['asset']], rng.randint(1, 10 ** 9))] if source['asset'] in reward_tokens else []
+                unspent[address].append(add_output(tx_id, 0, address, rng.randint(1, 50) * 10 ** 6, tokens))
+                add_output(tx_id, 1, source_addresses[name], rng.randint(100, 10 ** 4) * 10 ** 6)
+            elif unspent[address] and rng.random() < 0.4:
+                add_input(tx_id, unspent[address].pop(0))
+                add_output(tx_id, 0, f"addr_test1other{rng.randint(0, 10 ** 6)}", rng.randint(1, 20) * 10 ** 6)
+                unspent[address].append(add_output(tx_id, 1, address, rng.randint(1, 20) * 10 ** 6))
+            else:
+                tokens = [(rng.randint(1, len(token_names)), rng.randint(1, 10 ** 6))] if rng.random() < 0.2 else []
+                unspent[address].append(add_output(tx_id, 0, address, rng.randint(1, 100) * 10 ** 6, tokens))
+
+    # Unrelated txs, so the queries have to find the wallets among other data
+    for _ in range(noise):
+        tx_id = new_tx()
+        add_output(tx_id, 0, f"addr_test1other{rng.randint(0, 10 ** 6)}", rng.randint(1, 100) * 10 ** 6)
+
+    return rows, wallet_addresses
+
+def build_schema(conn, rows, stock=False):
+    """Create the synthetic schema, load its rows and index it."""
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA)
+        for table, table_rows in rows.items():
+            psycopg2.extras.execute_values(cur, f"INSERT INTO {table} VALUES %s", table_rows, page_size=5000)
+        if not stock:
+            for table, columns in index_advisor.RECOMMENDED_INDEXES:
+                cur.execute(index_advisor.index_statement(table, columns).replace(" CONCURRENTLY", ""))
+        cur.execute("ANALYZE;")
+    conn.commit()
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else None
+
+def summarize(calls, queries, rows):
+    """Throughput and p50/p99 latencies, in milliseconds, of one benchmarked operation."""
+    total = sum(calls)
+    return {
+        'calls': len(calls),
+        'total_s': round(total, 4),
+        'calls_per_s': round(len(calls) / total, 2) if total else None,
+        'rows': rows,
+        'rows_per_s': round(rows / total, 2) if total else None,
+        'p50_ms': round(percentile(calls, 0.5) * 1000, 3) if calls else None,
+        'p99_ms': round(percentile(calls, 0.99) * 1000, 3) if calls else None,
+        'queries': len(queries),
+        'query_p50_ms': round(percentile(queries, 0.5) * 1000, 3) if queries else None,
+        'query_p99_ms': round(percentile(queries, 0.99) * 1000, 3) if queries else None,
+    }
+
+def run_benchmarks(conn, wallet_addresses, repeat):
+    """Time every benchmarked operation end to end for each wallet."""
+    protocols = [protocol for protocol in rewards_engine.PROTOCOLS if rewards_engine.scanned_sources(protocol)]
+    # Each operation returns the number of rows it produced
+    operations = {
+        'get_transactions_for_address': lambda address, hashes: len(find_txs.get_transactions_for_address(address, conn)),
+        'check_addresses': lambda address, hashes: sum(len(rewards) for rewards in rewards_engine.check_addresses(
+            hashes, protocols, address, connection=conn)[1].values()),
+        'get_ada_amounts': lambda address, hashes: len(rewards_engine.get_ada_amounts(conn.cursor(), hashes, address)),
+        'get_asset_deltas': lambda address, hashes: len(rewards_engine.get_asset_deltas(conn.cursor(), hashes, address)),
+    }
+    hashes = {address: [tx_hash for tx_hash, _, _ in find_txs.get_transactions_for_address(address, conn)]
+              for address in wallet_addresses}
+
+    results = {}
+    for name, operation in operations.items():
+        calls, queries, rows = [], [], 0
+        for _ in range(repeat):
+            for address in wallet_addresses:
+                TimedCursor.latencies = []
+                started = time.perf_counter()
+                rows += operation(address, hashes[address])
+                calls.append(time.perf_counter() - started)
+                queries.extend(TimedCursor.latencies)
+        results[name] = summarize(calls, queries, rows)
+        print(f"-> {name}: p50 {results[name]['p50_ms']} ms, p99 {results[name]['p99_ms']} ms, "
+              f"{results[name]['calls_per_s']} calls/s")
+    return results
+
+def git_commit():
+    """Short hash of the checked out commit, or None outside a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, current):
+    """Print the p50/p99 change of every operation against a previous results file."""
+    print(f"\n-- Compared with {previous.get('commit')} ({previous.get('finished_at')}):")
+    for name, result in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p99_ms'):
+            if before.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%")
+        print(f"-> {name}: {', '.join(changes)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the tracker queries on a synthetic cexplorer schema.")
+    parser.add_argument("--dbname", default=BENCH_DBNAME, help="database to build the schema in (created if missing)")
+    parser.add_argument("--wallets", type=int, default=5, help="synthetic wallets")
+    parser.add_argument("--txs", type=int, default=2000, help="txs per wallet")
+    parser.add_argument("--payouts", type=int, default=200, help="reward payouts per wallet")
+    parser.add_argument("--assets", type=int, default=20, help="native assets")
+    parser.add_argument("--noise", type=int, default=50000, help="unrelated txs")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the synthetic data")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each operation per wallet")
+    parser.add_argument("--stock", action="store_true", help="only the dbsync keys, without the recommended indexes")
+    parser.add_argument("--reuse", action="store_true", help="benchmark the data already in --dbname")
+    parser.add_argument("--output", default=RESULTS_FILENAME, help="JSON results file")
+    parser.add_argument("--compare", metavar="FILE", help="previous results file to compare with")
+    args = parser.parse_args()
+
+    # SCHEMA drops the chain tables, so never point it at the db-sync database
+    if args.dbname == database.DB_CONFIG['dbname']:
+        print(f"Error: {args.dbname} is the db-sync database of db.py, pick another --dbname.")
+        return
+
+    config = {key: getattr(args, key) for key in ('wallets', 'txs', 'payouts', 'assets', 'noise', 'seed', 'repeat', 'stock')}
+    wallet_addresses = bench_wallets(args.wallets)
+    if not args.reuse:
+        rows, wallet_addresses = generate_data(args.wallets, args.txs, args.payouts, args.assets, args.noise, args.seed)
+        ensure_database(args.dbname)
+        if is_dbsync_database(args.dbname):
+            print(f"Error: {args.dbname} has db-sync's schema_version table, refusing to rebuild it.")
+            return
+        print(f"-- Loading {sum(len(table_rows) for table_rows in rows.values())} rows into {args.dbname}...")
+        conn = bench_connect(args.dbname)
+        try:
+            build_schema(conn, rows, args.stock)
+        finally:
+            conn.close()
+
+    # The asset cache of the benchmark stays apart from the real one
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    os.chdir(workdir.name)
+    assets._registry.clear()
+    assets._loaded_from = None
+
+    conn = bench_connect(args.dbname, TimedCursor)
+    try:
+        print(f"-- Benchmarking {args.wallets} wallets x {args.repeat} runs...")
+        results = run_benchmarks(conn, wallet_addresses, args.repeat)
+    finally:
+        conn.close()
+        os.chdir(cwd)
+        workdir.cleanup()
+        assets._registry.clear()
+        assets._loaded_from = None
+
+    report = {'commit': git_commit(), 'python': platform.python_version(),
+              'finished_at': datetime.now(timezone.utc).isoformat(), 'config': config, 'results': results}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            compare(json.load(file), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The shared reward engine lives in the repository root
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import rewards_engine
+
+if __name__ == "__main__":
+    rewards_engine.main(['cardano-staking'])
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import re
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+# Optional JSON file overriding DB_DEFAULTS, with the same keys
+CONFIG_FILENAME = os.environ.get(
+    "TRACKER_DB_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "db.json"))
+
+# Default database configuration
+DB_DEFAULTS = {
+    "dbname": "cexplorer",
+    "user": "user",
+    "password": "password",
+    "host": "localhost",
+    "port": 5432,
+    # Session settings applied to every connection
+    "statement_timeout": "0",
+    "work_mem": "64MB",
+}
+
+# Environment variables overriding the file and the defaults
+ENV_VARIABLES = {
+    "dbname": "PGDATABASE",
+    "user": "PGUSER",
+    "password": "PGPASSWORD",
+    "host": "PGHOST",
+    "port": "PGPORT",
+    "statement_timeout": "TRACKER_STATEMENT_TIMEOUT",
+    "work_mem": "TRACKER_WORK_MEM",
+}
+
+SESSION_SETTINGS = ("statement_timeout", "work_mem")
+
+# Cursor class of new connections, metrics.InstrumentedCursor with --profile
+CURSOR_FACTORY = psycopg2.extensions.cursor
+
+# Prepared statement name -> start of its SQL, to label EXECUTE statements
+PREPARED_LABELS = {}
+
+def load_config(filename=CONFIG_FILENAME):
+    """Database configuration from the defaults, then the JSON file, then the environment."""
+    config = dict(DB_DEFAULTS)
+    try:
+        with open(filename, 'r') as file:
+            config.update(json.load(file))
+    except FileNotFoundError:
+        pass
+    for key, variable in ENV_VARIABLES.items():
+        if os.environ.get(variable):
+            config[key] = os.environ[variable]
+    return config
+
+DB_CONFIG = load_config()
+
+def connect_kwargs(config=None):
+    """libpq keyword arguments of a configuration, the session settings passed as startup options."""
+    config = dict(config or DB_CONFIG)
+    settings = [f"-c {key}={config.pop(key)}" for key in SESSION_SETTINGS if config.get(key) is not None]
+    if settings:
+        config["options"] = " ".join(settings)
+    return config
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection remembering the statements it has prepared on the server."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+def statement_name(query):
+    """Stable prepared statement name of a query text."""
+    return "tracker_" + hashlib.md5(query.encode()).hexdigest()[:16]
+
+def execute(cursor, query, params=()):
+    """Run a query through PREPARE/EXECUTE, preparing it once per connection.
+
+    Connections not made by this module (and named cursors) run it as is.
+    """
+    connection = cursor.connection
+    if not isinstance(connection, PreparingConnection) or cursor.name:
+        cursor.execute(query, params)
+        return
+
+    name = statement_name(query)
+    if name not in connection.prepared:
+        count = iter(range(1, query.count("%s") + 1))
+        body = re.sub(r"%s", lambda match: f"${next(count)}", query).strip().rstrip(";")
+        cursor.execute(f"PREPARE {name} AS {body}")
+        connection.prepared.add(name)
+        PREPARED_LABELS[name] = " ".join(body.split())
+
+    if params:
+        cursor.execute(f"EXECUTE {name} ({', '.join('%s' for _ in params)})", params)
+    else:
+        cursor.execute(f"EXECUTE {name}")
+
+def connect():
+    """New connection with the shared configuration."""
+    return psycopg2.connect(connection_factory=PreparingConnection, cursor_factory=CURSOR_FACTORY, **connect_kwargs())
+
+def get_pool(maxconn, minconn=1):
+    """Thread-safe pool of up to maxconn connections with the shared configuration."""
+    return psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, connection_factory=PreparingConnection,
+                                                cursor_factory=CURSOR_FACTORY, **connect_kwargs())
@@ -0,0 +1,235 @@
+import argparse
+import os
+import sqlite3
+from decimal import Decimal
+
+import assets
+import store
+from packed_hashes import hash_bytes
+from rewards_engine import REPO_DIR, REWARD_SOURCES
+
+EXPORT_DIR = "export"
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+# Store rows converted per Arrow record batch
+EXPORT_BATCH_ROWS = 100000
+
+# Cardano mainnet: every epoch, Byron's included, lasts 5 days from the chain start
+MAINNET_START = 1506203091  # 2017-09-23T21:44:51Z, epoch 0
+EPOCH_SECONDS = 432000
+
+PERIODS = ('day', 'month', 'epoch')
+
+def load_pyarrow():
+    """The pyarrow modules used here, which are optional."""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("the columnar export needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+def schemas(pa):
+    """Arrow schema of each exported table."""
+    timestamp = pa.timestamp('s', tz='UTC')
+    # Asset quantities go up to 2**64 - 1, past int64; lovelace stays below 45e15
+    quantity = pa.decimal128(38, 0)
+    return {
+        'transactions': pa.schema([
+            ('wallet', pa.string()), ('tx_hash', pa.binary(32)), ('block_id', pa.int64()), ('time', timestamp),
+        ]),
+        'rewards': pa.schema([
+            ('wallet', pa.string()), ('protocol', pa.string()), ('source', pa.string()), ('tx_hash', pa.binary(32)),
+            ('block_id', pa.int64()), ('time', timestamp), ('lovelace', pa.int64()), ('token_asset', pa.string()),
+            ('token_quantity', quantity), ('tx_type', pa.string()),
+        ]),
+        'reward_assets': pa.schema([
+            ('wallet', pa.string()), ('protocol', pa.string()), ('tx_hash', pa.binary(32)), ('time', timestamp),
+            ('policy', pa.binary()), ('asset', pa.string()), ('quantity', quantity),
+        ]),
+    }
+
+def record_batch(pa, table, schema, rows):
+    """Arrow record batch of store rows, typed as the table's schema."""
+    columns = list(zip(*rows))
+    if table == 'transactions':
+        wallets, hashes, block_ids, times = columns
+        arrays = [wallets, [hash_bytes(tx_hash) for tx_hash in hashes], block_ids]
+    elif table == 'rewards':
+        wallets, protocols, sources, hashes, block_ids, times, lovelaces, token_quantities, tx_types = columns
+        token_assets = [REWARD_SOURCES[source]['asset'] if source in REWARD_SOURCES else None for source in sources]
+        token_assets = [asset if asset != 'ADA' else None for asset in token_assets]
+        arrays = [wallets, protocols, sources, [hash_bytes(tx_hash) for tx_hash in hashes], block_ids,
+                  lovelaces, token_assets, [Decimal(quantity) for quantity in token_quantities], tx_types]
+    else:
+        wallets, protocols, hashes, times, policies, asset_names, quantities = columns
+        arrays = [wallets, protocols, [hash_bytes(tx_hash) for tx_hash in hashes],
+                  [bytes.fromhex(policy) for policy in policies], asset_names,
+                  [Decimal(quantity) for quantity in quantities]]
+
+    # The block times are parsed by Arrow in one go, as UTC; unreadable ones are left null
+    parsed = pa.compute.strptime(pa.array(times, pa.string()), format='%Y-%m-%d %H:%M:%S', unit='s',
+                                 error_is_null=True).cast(schema.field('time').type)
+    arrays.insert(3 if table != 'rewards' else 5, parsed)
+    return pa.record_batch([pa.array(values, field.type) if not isinstance(values, pa.Array) else values
+                            for values, field in zip(arrays, schema)], schema=schema)
+
+def open_writer(pa, filename, schema, file_format):
+    if file_format == 'parquet':
+        return pa.parquet.ParquetWriter(filename, schema, compression='zstd')
+    return pa.ipc.new_file(filename, schema)
+
+def export_stores(stores, output_dir=EXPORT_DIR, file_format='parquet', batch_rows=EXPORT_BATCH_ROWS):
+    """Write the txs, rewards and per-asset amounts of the stores to one typed columnar file each.
+
+    Rows found in several stores (the same wallet synced in two folders) are
+    written once. Returns the number of rows written per table.
+    """
+    pa = load_pyarrow()
+    os.makedirs(output_dir, exist_ok=True)
+    # Store rows of each table and the key telling duplicates apart
+    readers = {
+        'transactions': (store.all_transactions, lambda row: row[:2]),
+        'rewards': (store.all_rewards, lambda row: row[:4]),
+        'reward_assets': (store.all_reward_assets, lambda row: row[:3] + row[4:6]),
+    }
+    counts = {}
+
+    for table, schema in schemas(pa).items():
+        read_rows, row_key = readers[table]
+        filename = os.path.join(output_dir, table + FORMATS[file_format])
+        writer = open_writer(pa, filename, schema, file_format)
+        seen = set()
+        counts[table] = 0
+        try:
+            for store_filename in stores:
+                db = sqlite3.connect(store_filename)
+                try:
+                    rows = read_rows(db)
+                    while True:
+                        batch = rows.fetchmany(batch_rows)
+                        if not batch:
+                            break
+                        new_rows = []
+                        for row in batch:
+                            key = row_key(row)
+                            if key not in seen:
+                                seen.add(key)
+                                new_rows.append(row)
+                        if new_rows:
+                            writer.write_batch(record_batch(pa, table, schema, new_rows))
+                            counts[table] += len(new_rows)
+                finally:
+                    db.close()
+        finally:
+            writer.close()
+        print(f"-> {counts[table]} rows written to {filename}")
+    return counts
+
+def read_export(pa, output_dir, table, columns, file_format, wallets=None):
+    """Columns of an exported table, only the rows of the wallets when given."""
+    filename = os.path.join(output_dir, table + FORMATS[file_format])
+    if file_format == 'parquet':
+        data = pa.parquet.read_table(filename, columns=columns)
+    else:
+        with pa.memory_map(filename) as source:
+            data = pa.ipc.open_file(source).read_all().select(columns)
+    if wallets:
+        data = data.filter(pa.compute.is_in(data['wallet'], value_set=pa.array(wallets, pa.string())))
+    return data
+
+def period_column(pa, times, period):
+    """Day (YYYY-MM-DD), month (YYYY-MM) or epoch number of every timestamp, computed on the whole column."""
+    # Parquet keeps the times in milliseconds. Dropping the UTC zone keeps the
+    # values and spares a time zone database lookup.
+    times = pa.compute.cast(times, pa.timestamp('s'), safe=False)
+    if period == 'epoch':
+        seconds = pa.compute.cast(times, pa.int64())
+        return pa.compute.divide(pa.compute.subtract(seconds, MAINNET_START), EPOCH_SECONDS)
+    return pa.compute.strftime(times, format='%Y-%m-%d' if period == 'day' else '%Y-%m')
+
+def aggregate(output_dir, period, file_format='parquet', wallets=None):
+    """Arrow table of the reward totals per period, protocol and asset across the wallets.
+
+    ADA comes from the rewards' lovelace, other assets from their per-asset
+    amounts. Quantities are summed as integers; amount is scaled by decimals.
+    """
+    pa = load_pyarrow()
+    rewards = read_export(pa, output_dir, 'rewards', ['wallet', 'protocol', 'time', 'lovelace'], file_format, wallets)
+    rewards = rewards.filter(pa.compute.not_equal(rewards['lovelace'], 0))
+    tokens = read_export(pa, output_dir, 'reward_assets', ['wallet', 'protocol', 'time', 'policy', 'asset', 'quantity'],
+                         file_format, wallets)
+
+    rows = pa.concat_tables([
+        pa.table({
+            'period': period_column(pa, rewards['time'], period),
+            'protocol': rewards['protocol'],
+            'policy': pa.nulls(rewards.num_rows, pa.binary()),
+            'asset': pa.array(['ADA'] * rewards.num_rows, pa.string()),
+            'quantity': rewards['lovelace'].cast(tokens.schema.field('quantity').type),
+        }),
+        pa.table({
+            'period': period_column(pa, tokens['time'], period),
+            'protocol': tokens['protocol'],
+            'policy': tokens['policy'],
+            'asset': tokens['asset'],
+            'quantity': tokens['quantity'],
+        }),
+    ])
+    totals = rows.group_by(['period', 'protocol', 'policy', 'asset']).aggregate(
+        [('quantity', 'sum'), ('quantity', 'count')])
+    totals = totals.sort_by([('period', 'ascending'), ('protocol', 'ascending'), ('asset', 'ascending')])
+
+    # The totals are small, the remaining columns are filled in Python
+    decimals = [assets.ADA_DECIMALS if policy is None else assets.asset_decimals(policy.hex(), asset)
+                for policy, asset in zip(totals['policy'].to_pylist(), totals['asset'].to_pylist())]
+    return pa.table({
+        'period': totals['period'],
+        'protocol': totals['protocol'],
+        'asset': totals['asset'],
+        'policy': pa.array([policy.hex() if policy else '' for policy in totals['policy'].to_pylist()], pa.string()),
+        'quantity': totals['quantity_sum'],
+        'amount': pa.array([assets.scaled_amount(quantity, places)
+                            for quantity, places in zip(totals['quantity_sum'].to_pylist(), decimals)], pa.float64()),
+        'rewards': totals['quantity_count'],
+    })
+
+def write_totals(pa, totals, filename):
+    """Write the totals as Parquet for a .parquet name, else CSV."""
+    if filename.endswith('.parquet'):
+        pa.parquet.write_table(totals, filename)
+    else:
+        pa.csv.write_csv(totals, filename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the tracker stores to typed Parquet/Arrow files and total the rewards per period.")
+    parser.add_argument('stores', nargs='*', help="tracker.db files to export (default: every one found in the repository)")
+    parser.add_argument('--dir', default=EXPORT_DIR, help=f"directory of the exported files (default {EXPORT_DIR})")
+    parser.add_argument('--format', choices=list(FORMATS), default='parquet', help="Parquet or Arrow IPC files")
+    parser.add_argument('--aggregate', choices=PERIODS, help="total the exported rewards per day, month or epoch")
+    parser.add_argument('--wallet', action='append', help="only total the rewards of this wallet; repeatable")
+    parser.add_argument('--output', help="totals file, .parquet or CSV (default totals-<period>.csv in --dir)")
+    parser.add_argument('--no-export', action='store_true', help="total the files already in --dir without exporting")
+    args = parser.parse_args()
+
+    try:
+        if not args.no_export:
+            stores = args.stores or store.find_stores(REPO_DIR)
+            if not stores:
+                print("Error: no tracker.db found, run find_txs.py and a rewards.py first.")
+                return
+            print(f"-- Exporting {', '.join(stores)} to {args.dir}...")
+            export_stores(stores, args.dir, args.format)
+
+        if args.aggregate:
+            totals = aggregate(args.dir, args.aggregate, args.format, args.wallet)
+            output = args.output or os.path.join(args.dir, f"totals-{args.aggregate}.csv")
+            write_totals(load_pyarrow(), totals, output)
+            print(f"Totals per {args.aggregate} ({totals.num_rows} rows) saved to {output}")
+    except (RuntimeError, OSError) as e:
+        print(f"Error: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,44 @@
+import argparse
 import psycopg2
 import csv
 import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 
-# Database configuration
-DB_CONFIG = {
-    "dbname": "cexplorer",
-    "user": "user",
-    "password": "password",
-    "host": "localhost",
-    "port": 5432,
+import db as database
+import metrics
+import reward_sinks
+import store
+
+# Rows fetched per round trip by the streaming server-side cursor
+STREAM_ITERSIZE = 5000
+
+# Seconds between chain tip polls in --follow mode
+FOLLOW_INTERVAL = 20
+
+# Parallel database connections used to sync a --wallets list or scan --windows
+SYNC_WORKERS = 4
+
+# Blocks per window with --windows
+WINDOW_SIZE = 100000
+
+# Stored txs checked against the chain per query when looking for a rollback's fork point
+ROLLBACK_BATCH = 500
+
+# Period bounds whose first block is older than this are settled and kept in tracker.db
+BOUND_SETTLE_TIME = timedelta(days=1)
+
+# First block at or after a period bound, through the indexed block.time and block.epoch_no
+BOUND_QUERIES = {
+    'time': "SELECT id, time FROM block WHERE time >= %s ORDER BY time LIMIT 1;",
+    'epoch': "SELECT id, time FROM block WHERE epoch_no >= %s ORDER BY epoch_no, id LIMIT 1;",
 }
 
+# (kind, value) -> block id or None, resolved once per run
+_block_bounds = {}
+
 def read_address_from_file(filename):
     """Reads an address from a file."""
     try:
@@ -20,23 +48,62 @@ def read_address_from_file(filename):
         print(f"Error reading {filename}: {e}")
         return None
 
-def get_latest_tx_date_from_csv(filename):
-    """Get the latest transaction date from existing CSV file."""
-    try:
-        with open(filename, mode='r', newline='') as file:
-            reader = csv.reader(file)
-            next(reader)  # Skip header
-            dates = [int(row[1]) for row in reader if row[1].isdigit()]
-            return max(dates) if dates else None
-        
-    except FileNotFoundError:
-        return None
-    except Exception as e:
-        print(f"Error reading latest date from CSV: {e}")
-        return None
+def resolve_stake_address(stake_address, conn):
+    """Id of a stake1... address in the stake_address table, or None."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM stake_address WHERE view = %s;", (stake_address,))
+        row = cur.fetchone()
+        return row[0] if row else None
+
+def block_filters(column, start_block=None, end_block=None):
+    """SQL conditions and params keeping column within (start_block, end_block]."""
+    filters = []
+    params = []
+    if start_block:
+        filters.append(f"AND {column} > %s")
+        params.append(start_block)
+    if end_block is not None:
+        filters.append(f"AND {column} <= %s")
+        params.append(end_block)
+    return " ".join(filters), params
+
+def build_transactions_query(address, start_block=None, order="b.time DESC", end_block=None, stake_address_id=None):
+    """Query and params listing the address txs after start_block, up to end_block.
+
+    With a stake_address_id the txs are found through the integer-indexed
+    tx_out.stake_address_id, on both the receiving and the spending side, so
+    every payment address under the stake key is covered.
+    """
+    filters, filter_params = block_filters("tx.block_id", start_block, end_block)
+
+    if stake_address_id is not None:
+        query = """
+        SELECT
+            encode(tx.hash, 'hex') AS tx_hash,
+            tx.block_id,
+            b.time AS block_time
+        FROM (
+            SELECT tx.id
+            FROM tx_out
+            JOIN tx ON tx.id = tx_out.tx_id
+            WHERE tx_out.stake_address_id = %s
+            {filters}
+            UNION
+            SELECT tx.id
+            FROM tx_out
+            JOIN tx_in ON tx_in.tx_out_id = tx_out.tx_id
+                AND tx_in.tx_out_index = tx_out.index
+            JOIN tx ON tx.id = tx_in.tx_in_id
+            WHERE tx_out.stake_address_id = %s
+            {filters}
+        ) wallet_txs
+        JOIN tx ON tx.id = wallet_txs.id
+        JOIN block b ON b.id = tx.block_id
+        ORDER BY {order};
+        """
+        params = [stake_address_id, *filter_params, stake_address_id, *filter_params]
+        return query.format(filters=filters, order=order), tuple(params)
 
-def get_transactions_for_address(address, conn, start_block=None):
-    """Fetch all transactions for the given address from the specified block."""
     query = """
     SELECT
         encode(tx.hash, 'hex') AS tx_hash,
@@ -46,24 +113,460 @@ def get_transactions_for_address(address, conn, start_block=None):
     JOIN tx ON tx.id = tx_out.tx_id
     JOIN block b ON b.id = tx.block_id
     WHERE tx_out.address = %s
-    {}
-    ORDER BY b.time DESC;
+    {filters}
+    ORDER BY {order};
     """
-    
-    if start_block:
-        query = query.format("AND tx.block_id > %s")
-        params = (address, start_block)
-    else:
-        query = query.format("")
-        params = (address,)
-        
+    return query.format(filters=filters, order=order), (address, *filter_params)
+
+def is_stake_address(address):
+    """True for stake1... (or stake_test1...) reward addresses."""
+    return address.startswith("stake")
+
+def read_wallets_file(filename):
+    """Read (name, address) pairs, one wallet per line as 'address' or 'name address'."""
+    wallets = []
+    with open(filename, 'r') as file:
+        for line in file:
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            wallets.append((parts[0], parts[1]) if len(parts) > 1 else (parts[0], parts[0]))
+    return wallets
+
+def get_transactions_for_address(address, conn, start_block=None, end_block=None, stake_address_id=None):
+    """Fetch all transactions for the given address from the specified block.
+
+    Errors are raised, not swallowed, so a failed fetch never looks like a wallet without new txs.
+    """
+    query, params = build_transactions_query(address, start_block, end_block=end_block, stake_address_id=stake_address_id)
+    with conn.cursor() as cur:
+        database.execute(cur, query, params)
+        return cur.fetchall()
+
+ADDRESSES_QUERY = """
+SELECT
+    tx_out.address,
+    encode(tx.hash, 'hex') AS tx_hash,
+    tx.block_id,
+    b.time AS block_time
+FROM tx_out
+JOIN tx ON tx.id = tx_out.tx_id
+JOIN block b ON b.id = tx.block_id
+WHERE tx_out.address = ANY(%s)
+AND tx.block_id > %s
+ORDER BY b.time DESC;
+"""
+
+def get_transactions_for_addresses(addresses, conn, start_blocks):
+    """Fetch the txs of several addresses in one query, each after its own start block.
+
+    Returns a dict of address -> list of (tx_hash, block_id, block_time). Errors are raised.
+    """
+    # The shared query starts from the oldest checkpoint; newer ones are filtered below
+    start = min(start_blocks.get(address) or 0 for address in addresses)
+    transactions = {address: [] for address in addresses}
+
+    with conn.cursor() as cur:
+        database.execute(cur, ADDRESSES_QUERY, (list(addresses), start))
+        for address, tx_hash, block_id, block_time in cur:
+            if block_id > (start_blocks.get(address) or 0):
+                transactions[address].append((tx_hash, block_id, block_time))
+    return transactions
+
+def fetch_with_pool(pool, address, start_block):
+    """Fetch the address (or stake address) txs on a connection borrowed from the pool. Errors are raised."""
+    conn = pool.getconn()
+    try:
+        stake_address_id = None
+        if is_stake_address(address):
+            stake_address_id = resolve_stake_address(address, conn)
+            if stake_address_id is None:
+                raise LookupError(f"{address} was not found in the stake_address table")
+        return get_transactions_for_address(address, conn, start_block, stake_address_id=stake_address_id)
+    finally:
+        pool.putconn(conn)
+
+def stream_transactions_for_address(address, conn, start_block=None, itersize=STREAM_ITERSIZE,
+                                    end_block=None, stake_address_id=None):
+    """Yield batches of transactions for the address, oldest block first, from a server-side cursor."""
+    query, params = build_transactions_query(address, start_block, "tx.block_id, tx.id", end_block, stake_address_id)
+
+    with conn.cursor(name="find_txs_stream") as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        while True:
+            batch = cur.fetchmany(itersize)
+            if not batch:
+                break
+            yield batch
+
+def stream_to_store(address, conn, db, start_block=None, itersize=STREAM_ITERSIZE, end_block=None, stake_address_id=None):
+    """Stream new transactions into the store one batch at a time. Returns the number of rows streamed."""
+    streamed = 0
+    last_block = None
+    started = time.monotonic()
+
+    for batch in stream_transactions_for_address(address, conn, start_block, itersize, end_block, stake_address_id):
+        last_block = batch[-1][1]
+        # The last block of a batch may continue in the next one, so only the blocks before it are complete
+        with metrics.phase("store"):
+            store.save_transactions(db, address, batch, checkpoint=last_block - 1)
+        streamed += len(batch)
+        rate = streamed / max(time.monotonic() - started, 1e-6)
+        metrics.progress("stream_txs", streamed, started)
+        print(f"-> {streamed} txs streamed, up to block {last_block} ({rate:.0f} txs/s)")
+
+    if last_block is not None:
+        store.set_checkpoint(db, address, last_block)
+    return streamed
+
+def fetch_window(pool, address, start_block, end_block, stake_address_id=None, running=None):
+    """Fetch the address txs of the (start_block, end_block] window on a pooled connection.
+
+    Errors are raised, not swallowed, so a failed window is never marked done.
+    The connection is in the running set while its query runs, so it can be cancelled.
+    """
+    query, params = build_transactions_query(address, start_block, "tx.block_id, tx.id", end_block, stake_address_id)
+    conn = pool.getconn()
+    if running is not None:
+        running.add(conn)
     try:
         with conn.cursor() as cur:
-            cur.execute(query, params)
+            database.execute(cur, query, params)
             return cur.fetchall()
-    except Exception as e:
-        print(f"Error fetching transactions for {address}: {e}")
-        return []
+    finally:
+        if running is not None:
+            running.discard(conn)
+        pool.putconn(conn)
+
+def scan_windows(address, conn, db, start_block=None, end_block=None, workers=SYNC_WORKERS,
+                 window_size=WINDOW_SIZE, stake_address_id=None):
+    """Scan the address history in block windows on a pool of workers. Returns the number of txs found.
+
+    Every finished window is committed to the store with its own checkpoint, so
+    an interrupted scan resumes from the windows that are still pending. The
+    wallet checkpoint only advances over windows finished in block order.
+    """
+    windows = store.pending_windows(db, address)
+    if not windows:
+        if end_block is None:
+            end_block = get_chain_tip(conn)
+        windows = store.plan_windows(db, address, start_block or 0, end_block or 0, window_size)
+    else:
+        print(f"-> Resuming an unfinished scan, {len(windows)} windows left.")
+    if not windows:
+        return 0
+
+    print(f"-- Scanning blocks {windows[0][0]} to {windows[-1][1]} in {len(windows)} windows with {workers} workers...\n")
+    found = 0
+    failed = 0
+    started = time.monotonic()
+    pool = database.get_pool(workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    running = set()
+    try:
+        futures = {executor.submit(fetch_window, pool, address, start, end, stake_address_id, running): (start, end)
+                   for start, end in windows}
+        # The store is only written from this thread, as each window finishes
+        for future in as_completed(futures):
+            start, end = futures[future]
+            try:
+                transactions = future.result()
+            except psycopg2.Error as e:
+                print(f"Error scanning blocks {start} to {end}: {e}")
+                failed += 1
+                continue
+            with metrics.phase("store"):
+                found += store.save_window(db, address, start, end, transactions)
+            metrics.progress("window_txs", found, started)
+            print(f"-> Blocks {start} to {end}: {len(transactions)} txs")
+    except KeyboardInterrupt:
+        # A window query can run for minutes: the running ones are cancelled on the server instead of awaited
+        for window_conn in list(running):
+            window_conn.cancel()
+        raise
+    finally:
+        # Pending windows are dropped, running ones must hand back their connection before the pool closes
+        executor.shutdown(wait=True, cancel_futures=True)
+        pool.closeall()
+
+    if failed:
+        print(f"-- {failed} windows failed, run again to scan only those.")
+    return found
+
+def get_chain_tip(conn):
+    """Id of the latest block ingested by dbsync."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT MAX(id) FROM block;")
+        return cur.fetchone()[0]
+
+def get_block(conn, block_id):
+    """(hash, slot_no) of a block, or None when dbsync has no such block."""
+    with conn.cursor() as cur:
+        cur.execute("SELECT encode(hash, 'hex'), slot_no FROM block WHERE id = %s;", (block_id,))
+        return cur.fetchone()
+
+def parse_period(value, end=False):
+    """(kind, value) bound of a --from/--to period: an epoch number, or an ISO date or date/time in UTC.
+
+    A --to period (end) is bounded by the start of the next epoch or day, so it
+    includes the whole epoch or day given.
+    """
+    if value.isdigit():
+        return 'epoch', int(value) + (1 if end else 0)
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if end and len(value) == 10:
+        moment += timedelta(days=1)
+    return 'time', moment
+
+def block_bound(conn, db, kind, value):
+    """Id of the first block at or after a period bound, or None past the tip.
+
+    Memoized for the run, and kept in tracker.db once the block is settled.
+    """
+    if (kind, value) in _block_bounds:
+        return _block_bounds[(kind, value)]
+    key = f"{kind}:{value.isoformat() if kind == 'time' else value}"
+    block_id = store.get_block_bound(db, key)
+    if block_id is None:
+        with conn.cursor() as cur:
+            cur.execute(BOUND_QUERIES[kind], (value,))
+            row = cur.fetchone()
+        if row is not None:
+            block_id, block_time = row
+            if block_time < datetime.now(timezone.utc).replace(tzinfo=None) - BOUND_SETTLE_TIME:
+                store.save_block_bound(db, key, block_id)
+    _block_bounds[(kind, value)] = block_id
+    return block_id
+
+def block_range(conn, db, start=None, end=None):
+    """(start_block, end_block) of the txs within the --from/--to periods, as block_filters bounds.
+
+    start_block is None without start, end_block None without end or when the
+    period has not ended yet.
+    """
+    start_block = end_block = None
+    if start:
+        first = block_bound(conn, db, *parse_period(start))
+        start_block = first - 1 if first is not None else get_chain_tip(conn)
+    if end:
+        after = block_bound(conn, db, *parse_period(end, end=True))
+        end_block = after - 1 if after is not None else None
+    return start_block, end_block
+
+def period_csv_filename(start=None, end=None):
+    """transactions-<from>-<to>.csv file of a --from/--to run, kept apart from the resumable transactions.csv."""
+    start, end = (value.replace(' ', 'T').replace(':', '') for value in (start or 'genesis', end or 'now'))
+    return f"transactions-{start}-{end}.csv"
+
+def record_checkpoint(conn, db, address):
+    """Store the hash and slot of the wallet checkpoint block, to detect rollbacks on the next run."""
+    checkpoint = store.get_checkpoint(db, address)
+    if checkpoint:
+        block = get_block(conn, checkpoint)
+        if block:
+            store.record_checkpoint_block(db, address, checkpoint, *block)
+
+def txs_on_chain(conn, tx_hashes):
+    """Dict of tx_hash -> block_id for the given txs still on chain."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT encode(hash, 'hex'), block_id FROM tx
+            WHERE hash = ANY(%s::bytea[]);
+        """, ([bytes.fromhex(tx_hash) for tx_hash in tx_hashes],))
+        return dict(cur.fetchall())
+
+def find_fork_block(conn, db, address, batch_size=ROLLBACK_BATCH):
+    """Block id of the wallet's newest stored tx still on chain in the same block, or 0."""
+    before_block = None
+    while True:
+        stored = store.recent_transactions(db, address, batch_size, before_block)
+        if not stored:
+            return 0
+        on_chain = txs_on_chain(conn, [tx_hash for tx_hash, _ in stored])
+        for tx_hash, block_id in stored:
+            if on_chain.get(tx_hash) == block_id:
+                return block_id
+        before_block = stored[-1][1]
+
+def verify_checkpoint(conn, db, address):
+    """Check the wallet checkpoint is still on chain, undoing the orphaned suffix if it is not.
+
+    The recorded checkpoint block hash is compared with dbsync; when none is
+    recorded yet the newest stored tx is checked instead. Returns the block id
+    the wallet was rolled back to, or None when nothing changed.
+    """
+    checkpoint = store.get_checkpoint_block(db, address)
+    if not checkpoint:
+        return None
+    block_id, block_hash, slot_no = checkpoint
+    if block_hash:
+        if get_block(conn, block_id) == (block_hash, slot_no):
+            return None
+    else:
+        latest_tx = store.latest_transaction(db, address)
+        if not latest_tx or txs_on_chain(conn, [latest_tx[0]]).get(latest_tx[0]) == latest_tx[1]:
+            return None
+
+    fork_block = find_fork_block(conn, db, address)
+    orphaned = store.rollback(db, address, fork_block)
+    print(f"-> Chain rollback detected after block {fork_block}: dropped {orphaned} orphaned txs, resyncing from there.\n")
+    return fork_block
+
+def follow_chain(address, conn, db, csv_filename, interval=FOLLOW_INTERVAL, protocols=None, stake_address_id=None):
+    """Poll the chain tip and store the address txs of every new block until interrupted.
+
+    When protocols are given, the rewards of the new txs are computed right away.
+    Returns the connection in use, which is replaced if the old one was lost.
+    """
+    if protocols:
+        import rewards_engine  # Imported here, the engine itself imports this module
+
+    # Every poll sees the latest dbsync data instead of one long-lived snapshot
+    conn.commit()
+    conn.autocommit = True
+    last_block = store.get_checkpoint(db, address) or 0
+    print(f"-- Following the chain tip every {interval}s from block {last_block} (Ctrl-C to stop)...\n")
+
+    while True:
+        try:
+            with metrics.phase("verify"):
+                rolled_back = verify_checkpoint(conn, db, address)
+            if rolled_back is not None:
+                last_block = store.get_checkpoint(db, address)
+                store.export_transactions_csv(db, address, csv_filename)
+                if protocols:
+                    rewards_engine.export_rewards(db, address, protocols)
+
+            tip = get_chain_tip(conn)
+            if tip and tip > last_block:
+                query, params = build_transactions_query(address, last_block, "tx.block_id, tx.id", tip, stake_address_id)
+                with metrics.phase("fetch"), conn.cursor() as cur:
+                    database.execute(cur, query, params)
+                    transactions = cur.fetchall()
+
+                with metrics.phase("store"):
+                    store.save_transactions(db, address, transactions)
+                    store.set_checkpoint(db, address, tip)
+                record_checkpoint(conn, db, address)
+                last_block = tip
+
+                if transactions:
+                    print(f"-> Block {tip}: {len(transactions)} new transactions")
+                    for tx_hash, block_id, timestamp in transactions:
+                        print(f"TxId: {tx_hash} Block: {block_id} Date/time: {timestamp}")
+                    with metrics.phase("csv"):
+                        save_transactions_to_csv(transactions, csv_filename, 'a' if os.path.exists(csv_filename) else 'w')
+
+                    if protocols:
+                        with metrics.phase("rewards"):
+                            rewards_engine.update_rewards(db, address, protocols, connection=conn,
+                                                          sinks=[reward_sinks.PrintSink(rewards_engine.format_reward)])
+                        rewards_engine.export_rewards(db, address, protocols)
+            # The textfile is refreshed every poll so a stalled follower can be alerted on
+            metrics.write_prometheus("find_txs")
+        except KeyboardInterrupt:
+            print("\n-- Stopped following the chain.")
+            return conn
+        except psycopg2.Error as e:
+            print(f"Error while following the chain: {e}")
+            if conn.closed:
+                conn = database.connect()
+                conn.autocommit = True
+
+        try:
+            time.sleep(interval)
+        except KeyboardInterrupt:
+            print("\n-- Stopped following the chain.")
+            return conn
+
+def write_transactions(db, address, transactions, csv_filename, start_block):
+    """Store new transactions and bring the wallet CSV up to date."""
+    with metrics.phase("store"):
+        store.save_transactions(db, address, transactions)
+
+    # Append to the CSV when it is already in sync, otherwise export it from the store
+    with metrics.phase("csv"):
+        if start_block and os.path.exists(csv_filename):
+            save_transactions_to_csv(transactions, csv_filename, 'a')
+        else:
+            store.export_transactions_csv(db, address, csv_filename)
+            print(f"Transactions saved to {csv_filename}")
+
+def sync_wallets(wallets, db, workers=SYNC_WORKERS, grouped=False):
+    """Sync several wallets, each from its own checkpoint, writing one transactions-<name>.csv per wallet.
+
+    Wallets are fetched in parallel on a bounded connection pool, or in a
+    single address = ANY(...) query when grouped. Returns the names of the
+    wallets that failed, whose checkpoints are left as they were.
+    """
+    names = {address: name for name, address in wallets}
+    conn = database.connect()
+    try:
+        for name, address in wallets:
+            if verify_checkpoint(conn, db, address) is not None:
+                store.export_transactions_csv(db, address, f"transactions-{name}.csv")
+    finally:
+        conn.close()
+    checkpoints = {address: store.get_checkpoint(db, address) for _, address in wallets}
+    # Stake addresses are not plain tx_out.address values, they are always fetched on their own
+    stake_addresses = [address for address in checkpoints if is_stake_address(address)]
+    failed = {}
+
+    def save(address, transactions):
+        print(f"-> {names[address]}: {len(transactions)} new transactions")
+        if transactions:
+            write_transactions(db, address, transactions, f"transactions-{names[address]}.csv", checkpoints[address])
+
+    if grouped:
+        addresses = [address for address in checkpoints if address not in stake_addresses]
+        conn = database.connect()
+        try:
+            if addresses:
+                try:
+                    grouped_transactions = get_transactions_for_addresses(addresses, conn, checkpoints)
+                except Exception as e:
+                    print(f"Error fetching transactions for {len(addresses)} addresses: {e}")
+                    failed.update((address, e) for address in addresses)
+                    grouped_transactions = {}
+                for address, transactions in grouped_transactions.items():
+                    save(address, transactions)
+                    record_checkpoint(conn, db, address)
+        finally:
+            conn.close()
+        checkpoints = {address: checkpoints[address] for address in stake_addresses}
+        if not checkpoints:
+            return [names[address] for address in failed]
+
+    pool = database.get_pool(workers)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_with_pool, pool, address, checkpoints[address]): address
+                       for address in checkpoints}
+            # The store is only written from this thread, as each wallet finishes
+            started = time.monotonic()
+            for done, future in enumerate(as_completed(futures), 1):
+                address = futures[future]
+                try:
+                    transactions = future.result()
+                except Exception as e:
+                    print(f"-> {names[address]}: failed: {e}")
+                    failed[address] = e
+                else:
+                    save(address, transactions)
+                metrics.progress("wallets", done, started)
+        conn = pool.getconn()
+        try:
+            for address in checkpoints:
+                if address not in failed:
+                    record_checkpoint(conn, db, address)
+        finally:
+            pool.putconn(conn)
+    finally:
+        pool.closeall()
+    return [names[address] for address in failed]
 
 def save_transactions_to_csv(transactions, filename, mode='w'):
     """Save the list of transactions to a CSV file."""
@@ -78,6 +581,80 @@ def save_transactions_to_csv(transactions, filename, mode='w'):
         print(f"Error saving transactions to CSV: {e}")
 
 def main():
+    parser = argparse.ArgumentParser(description="Find the txs of the address in wallet.addr.")
+    parser.add_argument("--stream", action="store_true", help="stream rows from a server-side cursor in constant memory")
+    parser.add_argument("--itersize", type=int, default=STREAM_ITERSIZE, help="rows fetched per round trip with --stream")
+    parser.add_argument("--follow", action="store_true", help="keep running and fetch the txs of every new block")
+    parser.add_argument("--interval", type=float, default=FOLLOW_INTERVAL, help="seconds between chain tip polls with --follow")
+    parser.add_argument("--rewards", nargs="*", metavar="PROTOCOL",
+                        help="with --follow, compute rewards for new txs (all protocols when none are named)")
+    parser.add_argument("--wallets", metavar="FILE", help="sync every wallet listed in FILE ('address' or 'name address' per line)")
+    parser.add_argument("--workers", type=int, default=SYNC_WORKERS, help="parallel database connections with --wallets or --windows")
+    parser.add_argument("--grouped", action="store_true", help="with --wallets, fetch all wallets in a single query")
+    parser.add_argument("--to-block", type=int, help="only sync txs up to this block id")
+    parser.add_argument("--from", dest="start", metavar="PERIOD",
+                        help="only sync txs from this epoch number or ISO date/time (UTC) on")
+    parser.add_argument("--to", dest="end", metavar="PERIOD",
+                        help="only sync txs up to the end of this epoch number or ISO date (or up to a date/time)")
+    parser.add_argument("--windows", action="store_true", help="scan the history in resumable block windows on --workers connections")
+    parser.add_argument("--window-size", type=int, default=WINDOW_SIZE, help="blocks per window with --windows")
+    parser.add_argument("--profile", nargs="?", const=metrics.PROFILE_FILENAME, metavar="FILE",
+                        help=f"append per-phase and per-query timings as JSON lines to FILE (default {metrics.PROFILE_FILENAME})")
+    parser.add_argument("--prometheus", metavar="FILE", help="write run metrics to a Prometheus textfile")
+    args = parser.parse_args()
+
+    if args.profile or args.prometheus:
+        metrics.enable(args.profile, args.prometheus)
+
+    if args.to_block is not None and (args.follow or args.wallets):
+        parser.error("--to-block cannot be combined with --follow or --wallets")
+    if args.end and (args.follow or args.wallets or args.to_block is not None):
+        parser.error("--to cannot be combined with --follow, --wallets or --to-block")
+    if (args.start or args.end) and (args.follow or args.wallets or args.stream or args.windows):
+        parser.error("--from and --to cannot be combined with --follow, --wallets, --stream or --windows")
+    for period in (args.start, args.end):
+        if period:
+            try:
+                parse_period(period)
+            except ValueError:
+                parser.error(f"{period} is neither an epoch number nor an ISO date")
+
+    if args.wallets:
+        if args.stream or args.follow or args.windows:
+            parser.error("--wallets cannot be combined with --stream, --follow or --windows")
+        try:
+            wallets = read_wallets_file(args.wallets)
+        except Exception as e:
+            print(f"Error reading {args.wallets}: {e}")
+            return
+        print(f"-- Syncing {len(wallets)} wallets...\n")
+        db = store.open_store()
+        failed = None
+        try:
+            with metrics.phase("sync wallets"):
+                failed = sync_wallets(wallets, db, args.workers, args.grouped)
+        except Exception as e:
+            print(f"An error occurred during processing: {e}")
+        finally:
+            db.close()
+            metrics.finish("find_txs")
+        if failed:
+            print(f"\nError: {len(failed)} of {len(wallets)} wallets failed to sync: {', '.join(failed)}")
+        if failed is None or failed:
+            sys.exit(1)
+        return
+
+    if args.stream and args.windows:
+        parser.error("--stream cannot be combined with --windows")
+
+    protocols = None
+    if args.rewards is not None:
+        import rewards_engine  # Imported here, the engine itself imports this module
+        protocols = args.rewards or list(rewards_engine.PROTOCOLS)
+        unknown = [protocol for protocol in protocols if protocol not in rewards_engine.PROTOCOLS]
+        if unknown:
+            parser.error(f"unknown protocols: {', '.join(unknown)}")
+
     csv_filename = "transactions.csv"
     
     # Read address from file
@@ -90,25 +667,107 @@ def main():
     # Connect to the database
     try:
         print("-- Connecting to the database...")
-        conn = psycopg2.connect(**DB_CONFIG)
+        with metrics.phase("connect"):
+            conn = database.connect()
         print("-> Connected to the database successfully.\n")
         print("-- This may take a while depending on how many txs the wallet has.\n-> Looking for txs...\n")
     except Exception as e:
         print(f"Error connecting to the database: {e}")
         return
     
+    db = None
     try:
-        # Get the latest transaction date from existing CSV
-        latest_block = get_latest_tx_date_from_csv(csv_filename)
-        
-        # Fetch transactions for the given address
-        transactions = get_transactions_for_address(address, conn, latest_block)
-        print(f"Found {len(transactions)} new transactions for {address}.\n")
+        db = store.open_store()
+
+        # Resume from the store checkpoint, seeding it once from an existing CSV. A store
+        # holding txs without a checkpoint only has periods, so it syncs from the first block.
+        latest_block = store.get_checkpoint(db, address)
+        if latest_block is None and os.path.exists(csv_filename) and not store.count_transactions(db, address):
+            imported = store.import_transactions_csv(db, address, csv_filename)
+            print(f"-> Imported {imported} transactions from {csv_filename} into {store.STORE_FILENAME}.\n")
+            latest_block = store.get_checkpoint(db, address)
+
+        # Undo the txs of blocks dbsync rolled back since the last run
+        with metrics.phase("verify"):
+            rolled_back = verify_checkpoint(conn, db, address)
+        if rolled_back is not None:
+            latest_block = store.get_checkpoint(db, address)
+            store.export_transactions_csv(db, address, csv_filename)
+
+        # A stake1... address in wallet.addr covers every payment address under that stake key
+        stake_address_id = None
+        if is_stake_address(address):
+            stake_address_id = resolve_stake_address(address, conn)
+            if stake_address_id is None:
+                print(f"Error: {address} was not found in the stake_address table.")
+                return
+            print(f"-> Found stake address id {stake_address_id} for {address}.\n")
+
+        # --from/--to periods become a block id range, resolved once
+        to_block = args.to_block
+        start_block = None
+        if args.start or args.end:
+            start_block, end_block = block_range(conn, db, args.start, args.end)
+            if args.end:
+                to_block = end_block
+            print(f"-> Blocks {start_block + 1 if start_block else 'genesis'} to {to_block or 'tip'} "
+                  f"for {args.start or 'the start'} to {args.end or 'now'}.\n")
+
+        # A period is fetched whole, wherever the checkpoint is, into its own CSV: transactions.csv
+        # would seed the checkpoint of a fresh store. The checkpoint only moves forward, when the
+        # period continues the synced history; a later one is stored so the txs before it still get synced.
+        period = bool(args.start or args.end)
+
+        if period:
+            with metrics.phase("fetch"):
+                transactions = get_transactions_for_address(address, conn, start_block, to_block, stake_address_id)
+            print(f"Found {len(transactions)} transactions for {address} in the period.\n")
+            with metrics.phase("store"):
+                if (start_block or 0) <= (latest_block or 0):
+                    checkpoint = max([latest_block or 0] + [block_id for _, block_id, _ in transactions])
+                    store.save_transactions(db, address, transactions, checkpoint)
+                    if checkpoint != (latest_block or 0):
+                        store.export_transactions_csv(db, address, csv_filename)
+                        print(f"Transactions saved to {csv_filename}")
+                else:
+                    store.add_transactions(db, address, transactions)
+            with metrics.phase("csv"):
+                save_transactions_to_csv(transactions, period_csv_filename(args.start, args.end))
+        elif args.stream:
+            # Every batch is committed to the store, so an interrupted run resumes where it stopped
+            transactions = []
+            try:
+                with metrics.phase("stream"):
+                    streamed = stream_to_store(address, conn, db, latest_block, args.itersize, to_block,
+                                               stake_address_id)
+                print(f"Found {streamed} new transactions for {address}.\n")
+            except KeyboardInterrupt:
+                print(f"\n-- Interrupted, the next run resumes after block {store.get_checkpoint(db, address)}.\n")
+            with metrics.phase("csv"):
+                store.export_transactions_csv(db, address, csv_filename)
+            print(f"Transactions saved to {csv_filename}")
+        elif args.windows:
+            # Every window is committed to the store, so an interrupted run only rescans the pending ones
+            transactions = []
+            try:
+                with metrics.phase("windows"):
+                    found = scan_windows(address, conn, db, latest_block, to_block, args.workers,
+                                         args.window_size, stake_address_id)
+                print(f"Found {found} new transactions for {address}.\n")
+            except KeyboardInterrupt:
+                print(f"\n-- Interrupted, the next run resumes the {len(store.pending_windows(db, address))} pending windows.\n")
+            with metrics.phase("csv"):
+                store.export_transactions_csv(db, address, csv_filename)
+            print(f"Transactions saved to {csv_filename}")
+        else:
+            # Fetch transactions for the given address
+            with metrics.phase("fetch"):
+                transactions = get_transactions_for_address(address, conn, latest_block, to_block, stake_address_id)
+            print(f"Found {len(transactions)} new transactions for {address}.\n")
 
         if transactions:
-            # Determine write mode based on whether we're updating or creating
-            mode = 'a' if latest_block else 'w'
-            save_transactions_to_csv(transactions, csv_filename, mode)
+            if not period:
+                write_transactions(db, address, transactions, csv_filename, latest_block)
 
             # Print sample of transactions found
             for tx_hash, block_id, timestamp in transactions[:5]:  # Show first 5 transactions
@@ -117,36 +776,28 @@ def main():
             if len(transactions) > 5:
                 print(f"... and {len(transactions) - 5} more")
         else:
-            # If no new transactions, read and display the latest from CSV
-            try:
-                with open(csv_filename, mode='r', newline='') as file:
-                    reader = csv.reader(file)
-                    next(reader)  # Skip header
-                    rows = list(reader)  # Convert to list to make sure it's not empty
-                    if not rows:
-                        print("No transaction history found.")
-                        return
-                        
-                    latest_tx = rows[0]
-                    max_block = int(rows[0][1])  # Start with first row's block_id
-                    
-                    for row in rows[1:]:  # Start from second row
-                        block_id = int(row[1])
-                        if block_id > max_block:
-                            max_block = block_id
-                            latest_tx = row
-                            
-                    print(f"No new transactions. Latest transaction:")
-                    print(f"TX: {latest_tx[0]}")
-                    print(f"Block: {latest_tx[1]}")
-                    print(f"Time: {latest_tx[2]}")
-            except FileNotFoundError:
+            # If no new transactions were listed, display the latest one from the store
+            latest_tx = store.latest_transaction(db, address)
+            if not latest_tx:
                 print("No transaction history found.")
+            else:
+                print("Latest transaction:" if args.stream or args.windows else "No new transactions. Latest transaction:")
+                print(f"TX: {latest_tx[0]}")
+                print(f"Block: {latest_tx[1]}")
+                print(f"Time: {latest_tx[2]}")
+
+        record_checkpoint(conn, db, address)
+
+        if args.follow:
+            conn = follow_chain(address, conn, db, csv_filename, args.interval, protocols, stake_address_id)
 
     except Exception as e:
         print(f"An error occurred during processing: {e}")
 
     finally:
+        if db:
+            db.close()
+
         # Close the connection to the database
         try:
             if conn:
@@ -155,6 +806,8 @@ def main():
         except Exception as e:
             print(f"Error closing the database connection: {e}")
 
+        metrics.finish("find_txs")
+
 if __name__ == "__main__":
     main()
 
@@ -0,0 +1,179 @@
+import argparse
+import json
+from datetime import datetime, timezone
+
+import db as database
+import find_txs
+import rewards_engine
+import store
+
+# Indexes the tracker queries rely on, as (table, leading columns). Stock
+# dbsync does not create all of them.
+RECOMMENDED_INDEXES = [
+    ('tx_out', ['address']),
+    ('tx_out', ['stake_address_id']),
+    ('tx', ['hash']),
+    ('tx', ['block_id']),
+    ('tx_in', ['tx_out_id', 'tx_out_index']),
+    ('tx_in', ['tx_in_id']),
+    ('ma_tx_out', ['tx_out_id']),
+    ('withdrawal', ['addr_id']),
+    ('stake_address', ['view']),
+]
+
+# Stored txs of the wallet used as the sample for the reward queries
+SAMPLE_SIZE = 100
+
+REPORT_FILENAME = "index-report.json"
+
+EXISTING_INDEXES_QUERY = """
+SELECT t.relname, array_agg(a.attname::text ORDER BY k.ord)
+FROM pg_index i
+JOIN pg_class t ON t.oid = i.indrelid
+JOIN LATERAL unnest(i.indkey) WITH ORDINALITY AS k(attnum, ord) ON true
+JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+WHERE t.relname = ANY(%s) AND i.indisvalid
+GROUP BY i.indexrelid, t.relname;
+"""
+
+def advisor_queries(address, tx_hashes, stake_address_id=None):
+    """(name, query, params) of the queries find_txs.py and the rewards engine issue for the wallet."""
+    queries = [('tx listing', *find_txs.build_transactions_query(address)),
+               ('tx listing incremental', *find_txs.build_transactions_query(address, 1, "tx.block_id, tx.id")),
+               ('wallets grouped', find_txs.ADDRESSES_QUERY, ([address], 0))]
+    if stake_address_id is not None:
+        queries.append(('tx listing by stake key',
+                        *find_txs.build_transactions_query(address, stake_address_id=stake_address_id)))
+        queries.append(('withdrawals', rewards_engine.WITHDRAWALS_QUERY.format(block_filters=""), (stake_address_id,)))
+
+    if tx_hashes:
+        hashes = rewards_engine.hash_params(tx_hashes)
+        protocols = list(rewards_engine.PROTOCOLS)
+        source_addresses = sorted(set().union(*rewards_engine.source_address_sets(protocols).values()))
+        wallet_filter = rewards_engine.wallet_filter(address)
+        queries += [
+            ('reward match', rewards_engine.MATCH_QUERY, (hashes, source_addresses)),
+            ('wallet ADA amounts', rewards_engine.ADA_AMOUNTS_QUERY.format(wallet_filter=wallet_filter),
+             (hashes, address, address)),
+            ('wallet asset deltas', rewards_engine.ASSET_DELTAS_QUERY.format(wallet_filter=wallet_filter),
+             (hashes, address, address)),
+        ]
+    return queries
+
+def plan_nodes(node):
+    """Every node of an EXPLAIN JSON plan tree."""
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+def explain(cursor, query, params, analyze=True):
+    """Summary of the EXPLAIN (ANALYZE, BUFFERS) plan of a query: costs, timings, buffers and seq scans."""
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    cursor.execute(f"EXPLAIN ({options}) {query}", params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]
+    return {
+        'total_cost': root['Plan']['Total Cost'],
+        'planning_ms': root.get('Planning Time'),
+        'execution_ms': root.get('Execution Time'),
+        'shared_hit_blocks': root['Plan'].get('Shared Hit Blocks'),
+        'shared_read_blocks': root['Plan'].get('Shared Read Blocks'),
+        'seq_scans': sorted({node['Relation Name'] for node in plan_nodes(root['Plan'])
+                             if 'Seq Scan' in node['Node Type'] and 'Relation Name' in node}),
+    }
+
+def explain_all(cursor, queries, analyze=True):
+    """Plan summary of every advisor query, printing the seq scans found."""
+    plans = {}
+    for name, query, params in queries:
+        try:
+            plans[name] = explain(cursor, query, params, analyze)
+        except Exception as e:
+            print(f"Error explaining {name}: {e}")
+            continue
+        plan = plans[name]
+        timing = f", {plan['execution_ms']:.1f} ms" if plan['execution_ms'] is not None else ""
+        warning = f" - SEQ SCAN on {', '.join(plan['seq_scans'])}" if plan['seq_scans'] else ""
+        print(f"-> {name}: cost {plan['total_cost']:.0f}{timing}{warning}")
+    return plans
+
+def missing_indexes(cursor):
+    """The RECOMMENDED_INDEXES not covered by the leading columns of an existing valid index."""
+    tables = sorted({table for table, _ in RECOMMENDED_INDEXES})
+    cursor.execute(EXISTING_INDEXES_QUERY, (tables,))
+    existing = cursor.fetchall()
+    return [(table, columns) for table, columns in RECOMMENDED_INDEXES
+            if not any(index_table == table and list(index_columns[:len(columns)]) == columns
+                       for index_table, index_columns in existing)]
+
+def index_statement(table, columns):
+    """CREATE INDEX CONCURRENTLY statement of a recommended index."""
+    name = f"tracker_{table}_{'_'.join(columns)}"
+    return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({', '.join(columns)});"
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the cexplorer query plans and indexes used by the tracker.")
+    parser.add_argument("--address", help="wallet address to plan the queries for (default: wallet.addr)")
+    parser.add_argument("--no-analyze", action="store_true", help="only estimate the plans, without running the queries")
+    parser.add_argument("--yes", action="store_true", help="create the missing indexes without asking")
+    parser.add_argument("--report", default=REPORT_FILENAME, help="JSON file for the before/after plans")
+    args = parser.parse_args()
+
+    address = args.address or find_txs.read_address_from_file("wallet.addr")
+    if not address:
+        print("Error: no address given and wallet.addr could not be read.")
+        return
+
+    tracker = store.open_store()
+    tx_hashes = [tx_hash for tx_hash, _ in store.recent_transactions(tracker, address, SAMPLE_SIZE)]
+    tracker.close()
+    if not tx_hashes:
+        print(f"-> No txs of {address} in {store.STORE_FILENAME}, the reward queries are skipped (run find_txs.py first).")
+
+    conn = database.connect()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    conn.autocommit = True
+    report = {'address': address, 'analyze': not args.no_analyze,
+              'started_at': datetime.now(timezone.utc).isoformat(), 'created_indexes': []}
+    try:
+        with conn.cursor() as cur:
+            stake_address_id = None
+            if find_txs.is_stake_address(address):
+                stake_address_id = find_txs.resolve_stake_address(address, conn)
+            queries = advisor_queries(address, tx_hashes, stake_address_id)
+
+            print("-- Query plans:")
+            report['before'] = explain_all(cur, queries, not args.no_analyze)
+
+            missing = missing_indexes(cur)
+            if not missing:
+                print("\n-> Every recommended index exists.")
+            else:
+                print("\n-- Missing indexes:")
+                for table, columns in missing:
+                    print(index_statement(table, columns))
+
+                answer = "y" if args.yes else input(f"\nCreate the {len(missing)} missing indexes CONCURRENTLY? [y/N] ")
+                if answer.strip().lower() in ("y", "yes"):
+                    for table, columns in missing:
+                        statement = index_statement(table, columns)
+                        print(f"-> {statement}")
+                        cur.execute(statement)
+                        report['created_indexes'].append(statement)
+                    cur.execute(f"ANALYZE {', '.join(sorted({table for table, _ in missing}))};")
+
+                    print("\n-- Query plans with the new indexes:")
+                    report['after'] = explain_all(cur, queries, not args.no_analyze)
+    except KeyboardInterrupt:
+        print("\n-- Interrupted.")
+    finally:
+        conn.close()
+
+    with open(args.report, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nPlans saved to {args.report}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2.extensions
+
+import db as database
+
+PROFILE_FILENAME = "profile.jsonl"
+
+# JSON lines sink and Prometheus textfile of the current run, None when disabled
+_sink = None
+_prometheus_filename = None
+_started = None
+
+# label -> [statements, seconds, rows, bytes sent, bytes received, round trips]
+_queries = {}
+# phase -> seconds
+_phases = {}
+# name -> (count, rate per second) of the latest progress event
+_progress = {}
+# Pool workers record from their own threads
+_lock = threading.Lock()
+
+def enabled():
+    """True when --profile or --prometheus is on."""
+    return _sink is not None or _prometheus_filename is not None
+
+def enable(profile_filename=None, prometheus_filename=None):
+    """Start recording, to JSON lines and/or a Prometheus textfile, and instrument new connections."""
+    global _sink, _prometheus_filename, _started
+    if profile_filename:
+        _sink = open(profile_filename, 'a')
+    _prometheus_filename = prometheus_filename
+    _started = time.monotonic()
+    database.CURSOR_FACTORY = InstrumentedCursor
+
+def emit(event, **fields):
+    """Write one structured event as a JSON line."""
+    if _sink is not None:
+        line = json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str)
+        with _lock:
+            _sink.write(line + "\n")
+
+def query_label(query):
+    """Short label of a statement: its prepared SQL for EXECUTE, else its first 80 characters."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = " ".join(query.split())
+    match = re.match(r"EXECUTE (\w+)", query)
+    if match:
+        query = database.PREPARED_LABELS.get(match.group(1), query)
+    return query[:80]
+
+def value_size(value):
+    """Approximate wire size of a fetched value."""
+    return len(value) if isinstance(value, (bytes, memoryview)) else len(str(value))
+
+def record_query(label, statements=0, seconds=0.0, rows=0, bytes_sent=0, bytes_received=0, round_trips=0):
+    """Add to the totals of a statement label."""
+    with _lock:
+        totals = _queries.setdefault(label, [0, 0.0, 0, 0, 0, 0])
+        totals[0] += statements
+        totals[1] += seconds
+        totals[2] += rows
+        totals[3] += bytes_sent
+        totals[4] += bytes_received
+        totals[5] += round_trips
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor recording the time, rows, bytes and round trips of every statement."""
+
+    label = None
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, params)
+        finally:
+            seconds = time.perf_counter() - started
+            self.label = query_label(query)
+            # Named cursors only count their rows as they are fetched
+            rows = self.rowcount if self.name is None and self.rowcount > 0 else 0
+            bytes_sent = len(self.query or b"")
+            record_query(self.label, 1, seconds, rows, bytes_sent, round_trips=1)
+            emit('query', query=self.label, ms=round(seconds * 1000, 3), rows=rows, bytes_sent=bytes_sent)
+
+    def _fetched(self, rows, started):
+        if self.label is not None and rows:
+            received = sum(value_size(value) for row in rows for value in row if value is not None)
+            named_rows = len(rows) if self.name is not None else 0
+            record_query(self.label, 0, time.perf_counter() - started if self.name is not None else 0.0,
+                         named_rows, bytes_received=received, round_trips=1 if self.name is not None else 0)
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched([row] if row is not None else [], started)
+        return row
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        return self._fetched(super().fetchmany(size) if size is not None else super().fetchmany(), started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        return self._fetched(super().fetchall(), started)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+@contextmanager
+def phase(name):
+    """Time a phase of a run (SQL, Python work and CSV writing are told apart by phase)."""
+    if not enabled():
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        _phases[name] = _phases.get(name, 0.0) + seconds
+        emit('phase', phase=name, ms=round(seconds * 1000, 3))
+
+def progress(name, count, started):
+    """Report the items done so far and their rate since the monotonic time started."""
+    if not enabled():
+        return
+    rate = count / max(time.monotonic() - started, 1e-6)
+    _progress[name] = (count, rate)
+    emit('progress', name=name, count=count, rate=round(rate, 2))
+
+def summary():
+    """Totals of the run so far: time, SQL time, per-phase and per-statement figures."""
+    sql_seconds = sum(totals[1] for totals in _queries.values())
+    return {
+        'total_ms': round((time.monotonic() - _started) * 1000, 3) if _started else None,
+        'sql_ms': round(sql_seconds * 1000, 3),
+        'statements': sum(totals[0] for totals in _queries.values()),
+        'round_trips': sum(totals[5] for totals in _queries.values()),
+        'rows': sum(totals[2] for totals in _queries.values()),
+        'bytes_sent': sum(totals[3] for totals in _queries.values()),
+        'bytes_received': sum(totals[4] for totals in _queries.values()),
+        'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in _phases.items()},
+        'queries': {label: {'statements': totals[0], 'ms': round(totals[1] * 1000, 3), 'rows': totals[2],
+                            'bytes_sent': totals[3], 'bytes_received': totals[4], 'round_trips': totals[5]}
+                    for label, totals in _queries.items()},
+    }
+
+def prometheus_label(value):
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def write_prometheus(job):
+    """Write the current totals to the Prometheus textfile, replacing it atomically."""
+    if _prometheus_filename is None:
+        return
+    lines = [
+        "# TYPE tracker_query_seconds_total counter",
+        *(f'tracker_query_seconds_total{{job="{job}",query="{prometheus_label(label)}"}} {totals[1]:.6f}'
+          for label, totals in _queries.items()),
+        "# TYPE tracker_query_rows_total counter",
+        *(f'tracker_query_rows_total{{job="{job}",query="{prometheus_label(label)}"}} {totals[2]}'
+          for label, totals in _queries.items()),
+        "# TYPE tracker_query_round_trips_total counter",
+        *(f'tracker_query_round_trips_total{{job="{job}",query="{prometheus_label(label)}"}} {totals[5]}'
+          for label, totals in _queries.items()),
+        "# TYPE tracker_query_bytes_received_total counter",
+        *(f'tracker_query_bytes_received_total{{job="{job}",query="{prometheus_label(label)}"}} {totals[4]}'
+          for label, totals in _queries.items()),
+        "# TYPE tracker_phase_seconds_total counter",
+        *(f'tracker_phase_seconds_total{{job="{job}",phase="{prometheus_label(name)}"}} {seconds:.6f}'
+          for name, seconds in _phases.items()),
+        "# TYPE tracker_progress_rate gauge",
+        *(f'tracker_progress_rate{{job="{job}",name="{prometheus_label(name)}"}} {rate:.3f}'
+          for name, (_, rate) in _progress.items()),
+        "# TYPE tracker_last_run_timestamp_seconds gauge",
+        f'tracker_last_run_timestamp_seconds{{job="{job}"}} {time.time():.0f}',
+    ]
+    temp_filename = f"{_prometheus_filename}.tmp"
+    with open(temp_filename, 'w') as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(temp_filename, _prometheus_filename)
+
+def finish(job):
+    """Emit the run summary, write the Prometheus textfile and close the sink."""
+    global _sink
+    if not enabled():
+        return
+    emit('summary', job=job, **summary())
+    write_prometheus(job)
+    if _sink is not None:
+        _sink.close()
+        _sink = None
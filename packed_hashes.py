@@ -0,0 +1,223 @@
+import array
+import bisect
+import mmap
+import sys
+import tempfile
+
+HASH_SIZE = 32
+
+# Buffers growing past this many bytes (about a million hashes) move to a
+# memory-mapped temporary file
+MMAP_THRESHOLD = 32 * 1024 * 1024
+
+# Records added after the index was built are kept in a set until there are
+# this many, or a sixteenth of the indexed ones, then merged into it
+TAIL_RECORDS = 4096
+
+def hash_bytes(tx_hash):
+    """Raw bytes of a tx hash given as bytes, memoryview or (\\x-prefixed) hex text."""
+    if isinstance(tx_hash, str):
+        return bytes.fromhex(tx_hash[2:] if tx_hash.startswith("\\x") else tx_hash)
+    return bytes(tx_hash)
+
+class PackedHashes:
+    """Unique tx hashes packed as 32-byte records in one buffer, in insertion order.
+
+    Lookups go through a sorted copy of the records, built on the first one,
+    and the first 4 bytes of each sorted record in an array searched with
+    bisect. Hashes that came in order are their own sorted copy. Records
+    added later wait in a set until it is worth merging them in.
+    """
+
+    def __init__(self, hashes=(), mmap_threshold=MMAP_THRESHOLD, unique=False):
+        self._buffer = bytearray()
+        self._used = 0
+        self._file = None
+        self._mmap_threshold = mmap_threshold
+        self._last = b""
+        self._in_order = True
+        # Sorted copy of the first _indexed records (None while it is the buffer), its prefixes and the later records
+        self._indexing = False
+        self._sorted = None
+        self._prefixes = array.array('I')
+        self._indexed = 0
+        self._tail = set()
+        for tx_hash in hashes:
+            self._append(_record(tx_hash))
+        # Hashes known to be distinct (tracker.db rows) skip the duplicate check
+        if not unique and not self._in_order:
+            self._drop_duplicates()
+
+    def __len__(self):
+        return self._used // HASH_SIZE
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        offset = position * HASH_SIZE
+        return bytes(self._buffer[offset:offset + HASH_SIZE])
+
+    def __iter__(self):
+        for offset in range(0, self._used, HASH_SIZE):
+            yield bytes(self._buffer[offset:offset + HASH_SIZE])
+
+    def __contains__(self, tx_hash):
+        record = hash_bytes(tx_hash)
+        if not self._indexing:
+            self._build_index()
+        if record in self._tail:
+            return True
+        position = self._position(record)
+        return position < self._indexed and self._sorted_records(position, position + 1) == record
+
+    def add(self, tx_hash):
+        """Append a hash unless already present. Returns True when it was added."""
+        record = _record(tx_hash)
+        if record in self:
+            return False
+        self._append(record)
+        return True
+
+    def _append(self, record):
+        if self._in_order and record <= self._last:
+            self._in_order = False
+        self._last = record
+        self._write(record)
+        if self._indexing:
+            self._tail.add(record)
+            # Merging copies every sorted record, so the tail grows with them
+            if len(self._tail) >= max(TAIL_RECORDS, self._indexed // 16):
+                self._merge_tail()
+
+    def _sorted_records(self, start, end):
+        return (self._buffer if self._sorted is None else self._sorted)[start * HASH_SIZE:end * HASH_SIZE]
+
+    def _position(self, record, low=0):
+        # Index of the record among the sorted ones, or of the first one after it
+        prefix = int.from_bytes(record[:4], 'big')
+        position = bisect.bisect_left(self._prefixes, prefix, low)
+        while (position < self._indexed and self._prefixes[position] == prefix
+               and self._sorted_records(position, position + 1) < record):
+            position += 1
+        return position
+
+    def _index_prefixes(self):
+        # Gathered with strided slices, without an object per record
+        sorted_records = self._buffer if self._sorted is None else self._sorted
+        prefixes = bytearray(4 * self._indexed)
+        for byte in range(4):
+            prefixes[byte::4] = sorted_records[byte:self._indexed * HASH_SIZE:HASH_SIZE]
+        self._prefixes = array.array('I')
+        self._prefixes.frombytes(prefixes)
+        if sys.byteorder == 'little':
+            self._prefixes.byteswap()
+
+    def _build_index(self):
+        self._indexing = True
+        if self._in_order:
+            self._indexed = len(self)
+        else:
+            self._sort_records()
+        self._index_prefixes()
+
+    def _sort_records(self):
+        """Build the sorted copy without repeats and return the records found more than once.
+
+        The records are sorted a first byte at a time, found through the
+        strided slice of first bytes, so only one bucket is held as objects.
+        """
+        firsts = self._buffer[0:self._used:HASH_SIZE]
+        self._sorted = bytearray(self._used)
+        self._indexed = 0
+        duplicates = set()
+        for first in range(256):
+            marker = bytes((first,))
+            bucket = []
+            position = firsts.find(marker)
+            while position != -1:
+                offset = position * HASH_SIZE
+                bucket.append(bytes(self._buffer[offset:offset + HASH_SIZE]))
+                position = firsts.find(marker, position + 1)
+            bucket.sort()
+            repeats = {record for previous, record in zip(bucket, bucket[1:]) if record == previous}
+            if repeats:
+                duplicates |= repeats
+                bucket = list(dict.fromkeys(bucket))
+            self._sorted[self._indexed * HASH_SIZE:(self._indexed + len(bucket)) * HASH_SIZE] = b"".join(bucket)
+            self._indexed += len(bucket)
+        del self._sorted[self._indexed * HASH_SIZE:]
+        return duplicates
+
+    def _drop_duplicates(self):
+        # The sorted copy leaves repeats out; the order is only rewritten when there were some, first occurrences kept
+        self._indexing = True
+        duplicates = self._sort_records()
+        self._index_prefixes()
+        if duplicates:
+            records, used, spilled = self._buffer, self._used, self._file
+            self._buffer, self._used, self._file = bytearray(), 0, None
+            seen = set()
+            for offset in range(0, used, HASH_SIZE):
+                record = bytes(records[offset:offset + HASH_SIZE])
+                if record in duplicates:
+                    if record in seen:
+                        continue
+                    seen.add(record)
+                self._write(record)
+            if spilled is not None:
+                records.close()
+                spilled.close()
+
+    def _merge_tail(self):
+        # Each tail record is placed by its prefix and the sorted records between them copied in blocks
+        merged = bytearray()
+        start = 0
+        for record in sorted(self._tail):
+            position = self._position(record, start)
+            merged += self._sorted_records(start, position)
+            merged += record
+            start = position
+        merged += self._sorted_records(start, self._indexed)
+        self._sorted = merged
+        self._indexed += len(self._tail)
+        self._tail.clear()
+        self._index_prefixes()
+
+    def _write(self, records):
+        if self._file is None and self._used + len(records) > self._mmap_threshold:
+            self._spill()
+        if self._file is None:
+            self._buffer += records
+        else:
+            while self._used + len(records) > len(self._buffer):
+                self._buffer.resize(len(self._buffer) * 2)
+            self._buffer[self._used:self._used + len(records)] = records
+        self._used += len(records)
+
+    def _spill(self):
+        # The file is twice the packed size so appends do not remap every time
+        self._file = tempfile.TemporaryFile()
+        self._file.write(self._buffer)
+        self._file.truncate(max(2 * self._used, mmap.PAGESIZE))
+        self._file.flush()
+        self._buffer = mmap.mmap(self._file.fileno(), max(2 * self._used, mmap.PAGESIZE))
+
+    def chunks(self, size):
+        """Consecutive lists of at most size hashes as bytes, ready to send as a bytea[] parameter."""
+        for start in range(0, len(self), size):
+            yield [self[position] for position in range(start, min(start + size, len(self)))]
+
+    def hex(self):
+        """The hashes as hex text, in order."""
+        for tx_hash in self:
+            yield tx_hash.hex()
+
+def _record(tx_hash):
+    record = hash_bytes(tx_hash)
+    if len(record) != HASH_SIZE:
+        raise ValueError(f"tx hash of {len(record)} bytes instead of {HASH_SIZE}")
+    return record
+
+def packed(tx_hashes):
+    """PackedHashes of a hash list, the list itself when already packed."""
+    return tx_hashes if isinstance(tx_hashes, PackedHashes) else PackedHashes(tx_hashes)
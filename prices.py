@@ -0,0 +1,90 @@
+import csv
+import os
+from array import array
+from datetime import datetime, timezone
+
+# Default price history, in the repository root next to the protocol folders
+PRICES_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prices.csv")
+
+# Columns added to rewards.csv when a price history is available
+PRICE_COLUMNS = [('ada_usd', 'ada_usd'), ('token_usd', 'token_usd'), ('usd_amount', 'usd_amount')]
+
+# filename -> {asset: (timestamps, prices)}, each series sorted by timestamp
+_loaded = {}
+
+def parse_timestamp(value):
+    """Unix time of an epoch number, ISO date/datetime string or datetime; naive times are UTC."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not isinstance(value, datetime):
+        try:
+            return float(value)
+        except ValueError:
+            value = datetime.fromisoformat(value.strip())
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def read_price_rows(filename):
+    """(timestamp, asset, price) rows of a CSV or Parquet price history."""
+    if filename.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError(f"reading {filename} needs pyarrow (pip install pyarrow)")
+        table = pq.read_table(filename, columns=['timestamp', 'asset', 'price']).to_pydict()
+        return zip(table['timestamp'], table['asset'], table['price'])
+
+    with open(filename, mode='r', newline='') as file:
+        return [(row['timestamp'], row['asset'], row['price']) for row in csv.DictReader(file)]
+
+def load_prices(filename=PRICES_FILENAME):
+    """Load a timestamp,asset,price (USD) history once into sorted arrays per asset."""
+    if filename not in _loaded:
+        points = {}
+        for timestamp, asset, price in read_price_rows(filename):
+            if price in (None, ''):
+                continue
+            points.setdefault(asset.upper(), []).append((parse_timestamp(timestamp), float(price)))
+
+        series = {}
+        for asset, asset_points in points.items():
+            asset_points.sort()
+            series[asset] = (array('d', [point[0] for point in asset_points]),
+                             array('d', [point[1] for point in asset_points]))
+        _loaded[filename] = series
+    return _loaded[filename]
+
+def prices_asof(series, timestamps):
+    """Latest price at or before each timestamp (None before the first one), in one merge pass."""
+    times, values = series
+    result = [None] * len(timestamps)
+    position = -1
+    for index in sorted(range(len(timestamps)), key=timestamps.__getitem__):
+        while position + 1 < len(times) and times[position + 1] <= timestamps[index]:
+            position += 1
+        if position >= 0:
+            result[index] = values[position]
+    return result
+
+def reward_timestamp(reward):
+    """Unix time of a reward from its tx_date and tx_time (block times are UTC)."""
+    return parse_timestamp(f"{reward['tx_date']}T{reward.get('tx_time') or '00:00'}")
+
+def enrich_rewards(rewards, prices, asset):
+    """Add the ada_usd, token_usd and usd_amount at tx time to a batch of reward rows of one asset."""
+    timestamps = [reward_timestamp(reward) for reward in rewards]
+    ada_usd = prices_asof(prices['ADA'], timestamps) if 'ADA' in prices else [None] * len(rewards)
+    token_usd = prices_asof(prices[asset.upper()], timestamps) if asset.upper() in prices and asset.upper() != 'ADA' \
+        else [None] * len(rewards)
+
+    for reward, ada_price, token_price in zip(rewards, ada_usd, token_usd):
+        reward['ada_usd'] = '' if ada_price is None else ada_price
+        reward['token_usd'] = '' if token_price is None else token_price
+        # The USD value is only known when every non-zero amount has a price
+        parts = [(reward['ada_amount'], ada_price), (reward['token_amount'], token_price)]
+        if any(amount and price is None for amount, price in parts):
+            reward['usd_amount'] = ''
+        else:
+            reward['usd_amount'] = round(sum(amount * price for amount, price in parts if amount), 6)
+    return rewards
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import db as database
+
+# Shared by every protocol folder, next to prices.csv
+CACHE_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "query-cache.db")
+
+# Entries kept; the least recently used ones are evicted first
+CACHE_SIZE = 500000
+
+# Blocks below the tip before a tx's results are final and cached (Cardano's k)
+FINALITY_DEPTH = 2160
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    query TEXT NOT NULL,
+    context TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    value TEXT NOT NULL,
+    used_at REAL NOT NULL,
+    PRIMARY KEY (query, context, tx_hash)
+);
+CREATE INDEX IF NOT EXISTS results_used_at ON results (used_at);
+"""
+
+# Id of the newest block at least the given number of blocks below the tip
+FINAL_BLOCK_QUERY = """
+SELECT id FROM block
+WHERE block_no <= (SELECT MAX(block_no) FROM block) - %s
+ORDER BY block_no DESC
+LIMIT 1;
+"""
+
+def open_cache(filename=CACHE_FILENAME):
+    """Open (and create if needed) the on-disk query result cache."""
+    cache = sqlite3.connect(filename)
+    cache.execute("PRAGMA journal_mode = WAL")
+    cache.executescript(SCHEMA)
+    return cache
+
+def query_version(query):
+    """Version of a query: the name of its prepared statement, so editing the SQL invalidates its entries."""
+    return database.statement_name(query)
+
+def context_key(*values):
+    """Short key of the parameters a result depends on besides the tx hash."""
+    return hashlib.md5(json.dumps(sorted(map(str, values))).encode()).hexdigest()
+
+def final_block(cursor, depth=FINALITY_DEPTH):
+    """Id of the newest final block, or None when the chain is shorter than depth."""
+    cursor.execute(FINAL_BLOCK_QUERY, (depth,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def lookup(cache, query, context, tx_hashes):
+    """Cached results of the txs, as ({tx_hash: value}, tx hashes to query). A value is None for no rows."""
+    hits = {}
+    for start in range(0, len(tx_hashes), 500):
+        batch = tx_hashes[start:start + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        hits.update((tx_hash, json.loads(value)) for tx_hash, value in cache.execute(f"""
+            SELECT tx_hash, value FROM results
+            WHERE query = ? AND context = ? AND tx_hash IN ({placeholders})
+        """, (query, context, *batch)))
+    if hits:
+        with cache:
+            cache.executemany("UPDATE results SET used_at = ? WHERE query = ? AND context = ? AND tx_hash = ?",
+                              [(time.time(), query, context, tx_hash) for tx_hash in hits])
+    return hits, [tx_hash for tx_hash in tx_hashes if tx_hash not in hits]
+
+def save(cache, query, context, queried, results, final, size=CACHE_SIZE):
+    """Cache the results of the queried txs that are final, a tx without results as None."""
+    now = time.time()
+    rows = [(query, context, tx_hash, json.dumps(results.get(tx_hash)), now)
+            for tx_hash in queried if tx_hash in final]
+    if not rows:
+        return
+    with cache:
+        cache.executemany("INSERT OR REPLACE INTO results (query, context, tx_hash, value, used_at) VALUES (?, ?, ?, ?, ?)",
+                          rows)
+        excess = cache.execute("SELECT COUNT(*) FROM results").fetchone()[0] - size
+        if excess > 0:
+            cache.execute("""
+                DELETE FROM results WHERE rowid IN (
+                    SELECT rowid FROM results ORDER BY used_at LIMIT ?
+                )
+            """, (excess,))
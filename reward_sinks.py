@@ -0,0 +1,70 @@
+import csv
+import json
+import os
+import time
+
+import assets
+
+# Rows a sink buffers at most, and the longest in seconds they wait, before a flush
+FLUSH_ROWS = 100
+FLUSH_INTERVAL = 5.0
+
+# Columns of the live files, the rows of every protocol together
+SINK_COLUMNS = ['protocol', 'source', 'txid', 'tx_date', 'tx_time', 'ada_amount', 'token_amount', 'tx_type']
+
+class RewardSink:
+    """Appends reward rows to a CSV or JSON lines (.jsonl) file as they are found, for tailing live."""
+
+    def __init__(self, filename, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.filename = filename
+        self.jsonl = filename.endswith(('.jsonl', '.ndjson'))
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self.file = open(filename, 'a', newline='')
+        self.writer = None if self.jsonl else csv.writer(self.file)
+        if new_file and not self.jsonl:
+            self.writer.writerow(SINK_COLUMNS)
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def write(self, protocol, rewards):
+        """Add the reward rows of a protocol; JSON lines also get their integer amounts and per-asset quantities."""
+        for reward in rewards:
+            row = {'protocol': protocol, **{key: reward[key] for key in SINK_COLUMNS[1:]}}
+            if self.jsonl:
+                row['lovelace'] = reward['lovelace']
+                row['token_quantity'] = reward['token_quantity']
+                row['assets'] = [[policy, asset, quantity, assets.scaled_amount(quantity, decimals)]
+                                 for policy, asset, quantity, decimals in reward.get('assets', ())]
+                self.file.write(json.dumps(row) + "\n")
+            else:
+                self.writer.writerow(row.values())
+            self.pending += 1
+        if self.pending >= self.flush_rows or time.monotonic() - self.flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+class PrintSink:
+    """Prints reward rows as they are found, each formatted by format_reward."""
+
+    def __init__(self, format_reward):
+        self.format_reward = format_reward
+
+    def write(self, protocol, rewards):
+        for reward in rewards:
+            print(f"New {protocol} reward: {self.format_reward(reward)}")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,114 @@
+import asyncio
+
+import psycopg
+
+import assets
+import db as database
+from packed_hashes import packed
+from rewards_engine import (ADA_AMOUNTS_QUERY, ASSET_DELTAS_QUERY, ASYNC_CONNECTIONS, BATCH_SIZE, MATCH_QUERY,
+                            build_rewards, cache_context, cache_lookup, cache_results, chunked, claim_transactions,
+                            claimed_txids, collect_matches, delta_quantities, delta_values, hash_params,
+                            matched_rows, source_address_sets, wallet_filter)
+
+# Queries queued on a connection before their results are read, in pipeline mode
+PIPELINE_DEPTH = 8
+
+async def run_on_connection(connection, jobs, depth=PIPELINE_DEPTH):
+    """Run (query, params) jobs on one connection, pipelined when libpq supports it. Returns their rows."""
+    results = []
+    if psycopg.Pipeline.is_supported():
+        for group in chunked(jobs, depth):
+            async with connection.pipeline():
+                cursors = []
+                for query, params in group:
+                    cursor = connection.cursor()
+                    await cursor.execute(query, params)
+                    cursors.append(cursor)
+                for cursor in cursors:
+                    results.append(await cursor.fetchall())
+                    await cursor.close()
+    else:
+        for query, params in jobs:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, params)
+                results.append(await cursor.fetchall())
+    return results
+
+async def run_jobs(connections, jobs):
+    """Spread (query, params) jobs over the connections and return their rows in job order."""
+    shares = [jobs[index::len(connections)] for index in range(len(connections))]
+    share_results = await asyncio.gather(*(run_on_connection(connection, share)
+                                           for connection, share in zip(connections, shares)))
+    results = [None] * len(jobs)
+    for index, share in enumerate(share_results):
+        results[index::len(connections)] = share
+    return results
+
+async def check_addresses(transaction_hashes, protocols, wallet_address, batch_size=BATCH_SIZE,
+                          connections=ASYNC_CONNECTIONS, cache=None, final=()):
+    """Async rewards_engine.check_addresses, running the batches on several pipelined connections.
+
+    Returns the number of matched txs and the reward rows of each protocol.
+    """
+    if not transaction_hashes:
+        return 0, {protocol: [] for protocol in protocols}
+
+    if cache is None:
+        addresses = source_address_sets(protocols)
+        all_addresses = sorted(set().union(*addresses.values()))
+        match_context = wallet_context = None
+    else:
+        addresses, all_addresses, match_context, wallet_context = cache_context(protocols, wallet_address)
+    hashes = packed(transaction_hashes)
+    pool = await asyncio.gather(*(psycopg.AsyncConnection.connect(**database.connect_kwargs())
+                                  for _ in range(connections)))
+
+    try:
+        hits, misses = cache_lookup(cache, MATCH_QUERY, match_context, hashes)
+        batches = list(packed(misses).chunks(batch_size))
+        rows = await run_jobs(pool, [(MATCH_QUERY, (batch, all_addresses)) for batch in batches])
+        results = {txid: [tx_date, tx_time, sorted(paying_addresses)]
+                   for batch, batch_rows in zip(batches, rows)
+                   for txid, tx_date, tx_time, paying_addresses in collect_matches(batch_rows, batch)}
+        matched = matched_rows(cache_results(cache, final, MATCH_QUERY, match_context, misses, results, hits),
+                               hashes, addresses)
+        claims = claim_transactions(matched, protocols, addresses)
+
+        # The ADA and per-asset batches all go out together
+        wallet_params = (wallet_address, wallet_address)
+        ada_query = ADA_AMOUNTS_QUERY.format(wallet_filter=wallet_filter(wallet_address))
+        deltas_query = ASSET_DELTAS_QUERY.format(wallet_filter=wallet_filter(wallet_address))
+        ada_hits, ada_misses = cache_lookup(cache, ada_query, wallet_context, claimed_txids(claims, ada_only=True))
+        deltas_hits, deltas_misses = cache_lookup(cache, deltas_query, wallet_context, claimed_txids(claims))
+        ada_jobs = [(ada_query, (hash_params(batch), *wallet_params)) for batch in chunked(ada_misses, batch_size)]
+        deltas_jobs = [(deltas_query, (hash_params(batch), *wallet_params))
+                       for batch in chunked(deltas_misses, batch_size)]
+        rows = await run_jobs(pool, ada_jobs + deltas_jobs)
+
+        ada_amounts = {}
+        for txid, lovelace in (row for batch_rows in rows[:len(ada_jobs)] for row in batch_rows):
+            ada_amounts[bytes(txid).hex()] = int(lovelace) if lovelace is not None else 0
+        deltas = {}
+        for txid, ident, quantity in (row for batch_rows in rows[len(ada_jobs):] for row in batch_rows):
+            deltas.setdefault(bytes(txid).hex(), {})[ident] = quantity
+        ada_amounts = cache_results(cache, final, ada_query, wallet_context, ada_misses, ada_amounts, ada_hits)
+        deltas = delta_quantities(cache_results(cache, final, deltas_query, wallet_context, deltas_misses,
+                                                delta_values(deltas), deltas_hits))
+
+        idents = {ident for tx_deltas in deltas.values() for ident in tx_deltas}
+        missing = assets.missing_assets(idents)
+        if missing:
+            assets.register_assets((await run_jobs(pool, [(assets.MULTI_ASSET_QUERY, (missing,))]))[0])
+        registry = assets.cached_assets(idents)
+        if missing:
+            assets.save_cache()
+    finally:
+        await asyncio.gather(*(connection.close() for connection in pool))
+
+    return len(matched), build_rewards(protocols, claims, ada_amounts, deltas, registry)
+
+def run_check_addresses(transaction_hashes, protocols, wallet_address, batch_size=BATCH_SIZE,
+                        connections=ASYNC_CONNECTIONS, cache=None, final=()):
+    """Run the async check_addresses to completion from synchronous code."""
+    return asyncio.run(check_addresses(transaction_hashes, protocols, wallet_address, batch_size, connections,
+                                       cache, final))
@@ -0,0 +1,792 @@
+import argparse
+import csv
+import os
+import time
+
+import assets
+import db as database
+import metrics
+import packed_hashes
+import prices
+import query_cache
+import reward_sinks
+import store
+from find_txs import block_filters, block_range, is_stake_address, parse_period
+
+# Directory holding this file and the protocol folders
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Number of tx hashes sent to the database per lookup query
+BATCH_SIZE = 1000
+
+# Connections used by the async engine (rewards_async.py) with --async
+ASYNC_CONNECTIONS = 4
+
+def indigo_ada_tx_type(ada_value, token_value):
+    if ada_value < 0:
+        return "Governance vote"
+    else:
+        return "ADA Rewards withdraw"
+
+def stuff_tx_type(ada_value, token_value):
+    if ada_value < 0:
+        return "Governance vote"
+    else:
+        return "Bible NFT holder airdrop"
+
+# Reward sources. Each one is declared by the file listing its sender addresses
+# (inside its protocol folder), the asset it pays out, how the wallet amount is
+# computed and a classifier returning the tx_type of a matched tx.
+#
+# amount: 'ada'        - net ADA delta of the wallet
+#         'ada_tokens' - net ADA delta and net delta of the source asset
+#         'token'      - net delta of the source asset
+#
+# The source asset of 'token' and 'ada_tokens' sources is matched by its
+# 'policy' id, and by its on-chain 'asset_name' too when the source sets one.
+# Every reward also keeps the net delta of each asset it moved.
+#
+# method: 'outputs'     - (default) scan the wallet txs for outputs from the sender addresses
+#         'withdrawals' - read the wallet stake key's reward withdrawals straight from
+#                         dbsync's withdrawal table, without scanning the tx history
+#
+# A new tracker is one entry here plus its protocol in PROTOCOLS below.
+REWARD_SOURCES = {
+    'indy': {
+        'protocol': 'indigoprotocol-io',
+        'addresses_file': 'indy-rewards.addr',
+        'asset': 'INDY',
+        'policy': assets.INDY_POLICY,
+        'asset_name': 'INDY',
+        'amount': 'token',
+        'tx_type': lambda ada_value, token_value: "INDY rewards withdraw",
+    },
+    'indigo-ada': {
+        'protocol': 'indigoprotocol-io',
+        'addresses_file': 'ada-rewards.addr',
+        'asset': 'ADA',
+        'amount': 'ada',
+        'tx_type': indigo_ada_tx_type,
+    },
+    'stuff': {
+        'protocol': 'stuff-io',
+        'addresses_file': 'stuff-wallet.addr',
+        'asset': 'STUFF',
+        'policy': assets.STUFF_POLICY,  # Any asset of the policy, so the BOOK to STUFF renaming does not matter
+        'amount': 'ada_tokens',
+        'tx_type': stuff_tx_type,
+    },
+    'angels': {
+        'protocol': 'angelfinance',
+        'addresses_file': 'angels-wallet.addr',
+        'asset': 'ADA',
+        'amount': 'ada',
+        'positive_only': True,  # Only consider positive ADA values
+        'tx_type': lambda ada_value, token_value: "Angels ADA airdrop",
+    },
+    'staking': {
+        'protocol': 'cardano-staking',
+        'method': 'withdrawals',
+        'asset': 'ADA',
+        'amount': 'ada',
+        'tx_type': lambda ada_value, token_value: "Staking rewards withdraw",
+    },
+}
+
+# Sources and rewards.csv layout of each protocol folder. When a tx pays out
+# from several sources of the same protocol, the first one listed claims it.
+PROTOCOLS = {
+    'indigoprotocol-io': {
+        'sources': ['indy', 'indigo-ada'],
+        'columns': [('txid', 'txid'), ('tx_date', 'tx_date'), ('ada_amount', 'ada_amount'),
+                    ('indy_amount', 'token_amount'), ('tx_type', 'tx_type')],
+    },
+    'stuff-io': {
+        'sources': ['stuff'],
+        'columns': [('txid', 'txid'), ('tx_date', 'tx_date'), ('ada_amount', 'ada_amount'),
+                    ('na_amount', 'token_amount'), ('tx_type', 'tx_type')],
+    },
+    'angelfinance': {
+        'sources': ['angels'],
+        'columns': [('txid', 'txid'), ('tx_date', 'tx_date'), ('tx_time', 'tx_time'),
+                    ('ada_amount', 'ada_amount')],
+    },
+    'cardano-staking': {
+        'sources': ['staking'],
+        'columns': [('txid', 'txid'), ('tx_date', 'tx_date'), ('tx_time', 'tx_time'),
+                    ('ada_amount', 'ada_amount'), ('tx_type', 'tx_type')],
+    },
+}
+
+# Layout of the per-asset breakdown written next to each rewards.csv
+ASSET_COLUMNS = [('txid', 'txid'), ('tx_date', 'tx_date'), ('policy', 'policy'), ('asset', 'asset'),
+                 ('quantity', 'quantity'), ('amount', 'amount')]
+
+def read_address(file_path):
+    """Read a single address from a file."""
+    with open(file_path, mode='r') as file:
+        return file.read().strip()
+
+def read_addresses(file_path):
+    """Read one address per line from a file."""
+    with open(file_path, mode='r') as file:
+        return [addr.strip() for addr in file.read().split('\n') if addr.strip()]
+
+def source_addresses_file(name):
+    """Path of the sender addresses file of a reward source."""
+    source = REWARD_SOURCES[name]
+    return os.path.join(REPO_DIR, source['protocol'], source['addresses_file'])
+
+def source_method(name):
+    """How a reward source is found: 'outputs' or 'withdrawals'."""
+    return REWARD_SOURCES[name].get('method', 'outputs')
+
+def scanned_sources(protocol):
+    """Sources of a protocol that need the wallet tx history scanned."""
+    return [name for name in PROTOCOLS[protocol]['sources'] if source_method(name) == 'outputs']
+
+def describe_source(name):
+    """Where a reward source pays out from, for printing."""
+    if source_method(name) == 'withdrawals':
+        return "stake key withdrawals"
+    return f"reward addresses ({', '.join(read_addresses(source_addresses_file(name)))})"
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def hash_key(tx_hash):
+    """Hex form of a tx hash given as bytes or as (\\x-prefixed) hex text, as used for txids."""
+    if not isinstance(tx_hash, str):
+        return bytes(tx_hash).hex()
+    return tx_hash[2:].lower() if tx_hash.startswith("\\x") else tx_hash.lower()
+
+def hash_params(txids):
+    """bytea[] parameter of a list of tx hashes as raw bytes.
+
+    psycopg 3 sends them in binary; psycopg2 interpolates them as '\\x...'::bytea
+    hex literals, which Postgres still compares without decoding tx.hash.
+    """
+    return [packed_hashes.hash_bytes(txid) for txid in txids]
+
+# SQL shared by the synchronous engine and rewards_async.py. The amount
+# queries select the wallet outputs through a {wallet_filter} condition.
+MATCH_QUERY = """
+SELECT DISTINCT
+    tx.hash AS txid,
+    to_char(block.time, 'YYYY-MM-DD') AS tx_date,
+    to_char(block.time, 'HH24:MI') AS tx_time,
+    tx_out.address AS output_address
+FROM tx_out
+INNER JOIN tx ON tx_out.tx_id = tx.id
+INNER JOIN block ON tx.block_id = block.id
+WHERE tx.hash = ANY(%s::bytea[])
+AND tx_out.address = ANY(%s);
+"""
+
+ADA_AMOUNTS_QUERY = """
+WITH txs AS (
+    SELECT tx.id, tx.hash
+    FROM tx
+    WHERE tx.hash = ANY(%s::bytea[])
+),
+inputs AS (
+    SELECT txs.id AS tx_id, SUM(tx_out.value) as input_sum
+    FROM txs
+    JOIN tx_in ON tx_in.tx_in_id = txs.id
+    JOIN tx_out ON tx_in.tx_out_id = tx_out.tx_id
+        AND tx_in.tx_out_index = tx_out.index
+    WHERE {wallet_filter}
+    GROUP BY txs.id
+),
+outputs AS (
+    SELECT txs.id AS tx_id, SUM(tx_out.value) as output_sum
+    FROM txs
+    JOIN tx_out ON tx_out.tx_id = txs.id
+    WHERE {wallet_filter}
+    GROUP BY txs.id
+)
+SELECT txs.hash,
+        COALESCE(output_sum, 0) - COALESCE(input_sum, 0) AS lovelace
+FROM txs
+LEFT JOIN inputs ON inputs.tx_id = txs.id
+LEFT JOIN outputs ON outputs.tx_id = txs.id;
+"""
+
+ASSET_DELTAS_QUERY = """
+WITH txs AS (
+    SELECT tx.id, tx.hash
+    FROM tx
+    WHERE tx.hash = ANY(%s::bytea[])
+),
+moves AS (
+    SELECT txs.id AS tx_id, ma_tx_out.ident, -ma_tx_out.quantity AS quantity
+    FROM txs
+    JOIN tx_in ON tx_in.tx_in_id = txs.id
+    JOIN tx_out ON tx_in.tx_out_id = tx_out.tx_id
+        AND tx_in.tx_out_index = tx_out.index
+    JOIN ma_tx_out ON ma_tx_out.tx_out_id = tx_out.id
+    WHERE {wallet_filter}
+    UNION ALL
+    SELECT txs.id AS tx_id, ma_tx_out.ident, ma_tx_out.quantity
+    FROM txs
+    JOIN tx_out ON tx_out.tx_id = txs.id
+    JOIN ma_tx_out ON ma_tx_out.tx_out_id = tx_out.id
+    WHERE {wallet_filter}
+)
+SELECT txs.hash, moves.ident, SUM(moves.quantity) AS quantity
+FROM moves
+JOIN txs ON txs.id = moves.tx_id
+GROUP BY txs.hash, moves.ident
+HAVING SUM(moves.quantity) <> 0;
+"""
+
+def collect_matches(rows, batch):
+    """Group the MATCH_QUERY rows of a batch into (txid, tx_date, tx_time, paying_addresses), in batch order."""
+    found = {}
+    for txid, tx_date, tx_time, output_address in rows:
+        txid = bytes(txid)
+        found.setdefault(txid, (txid.hex(), tx_date, tx_time, set()))[3].add(output_address)
+
+    # Walk the batch in file order so the output matches a per-hash lookup
+    return [found[tx_hash] for tx_hash in map(packed_hashes.hash_bytes, batch) if tx_hash in found]
+
+def match_transactions(cursor, transaction_hashes, addresses, batch_size=BATCH_SIZE):
+    """Find the txs with an output from any of the addresses, in file order.
+
+    Returns a list of (txid, tx_date, tx_time, paying_addresses) with txid as hex.
+    """
+    matched = []
+    for batch in packed_hashes.packed(transaction_hashes).chunks(batch_size):
+        database.execute(cursor, MATCH_QUERY, (batch, addresses))
+        matched.extend(collect_matches(cursor.fetchall(), batch))
+    return matched
+
+def wallet_filter(wallet_address):
+    """SQL condition selecting the wallet outputs; a stake address matches every output under its stake key."""
+    if is_stake_address(wallet_address):
+        return "tx_out.stake_address_id = (SELECT id FROM stake_address WHERE view = %s)"
+    return "tx_out.address = %s"
+
+def get_ada_amounts(cursor, txids, wallet_address, batch_size=BATCH_SIZE):
+    """Net wallet ADA amount per tx, in lovelace, for a list of hex txids."""
+    query = ADA_AMOUNTS_QUERY.format(wallet_filter=wallet_filter(wallet_address))
+
+    amounts = {}
+    for batch in chunked(txids, batch_size):
+        database.execute(cursor, query, (hash_params(batch), wallet_address, wallet_address))
+        for txid, lovelace in cursor.fetchall():
+            amounts[bytes(txid).hex()] = int(lovelace) if lovelace is not None else 0
+    return amounts
+
+def get_asset_deltas(cursor, txids, wallet_address, batch_size=BATCH_SIZE):
+    """Net wallet quantity of every native asset moved per tx, as {txid: {multi_asset.id: quantity}}."""
+    query = ASSET_DELTAS_QUERY.format(wallet_filter=wallet_filter(wallet_address))
+
+    deltas = {}
+    for batch in chunked(txids, batch_size):
+        database.execute(cursor, query, (hash_params(batch), wallet_address, wallet_address))
+        for txid, ident, quantity in cursor.fetchall():
+            deltas.setdefault(bytes(txid).hex(), {})[ident] = quantity
+    return deltas
+
+def source_asset_quantity(name, asset_quantities):
+    """(net quantity, decimals) of the source's asset among the (policy, asset, quantity, decimals) breakdown of a tx."""
+    source = REWARD_SOURCES[name]
+    quantity = sum(asset_quantity for policy, asset, asset_quantity, _ in asset_quantities
+                   if policy == source['policy'] and source.get('asset_name', asset) == asset)
+    return quantity, assets.asset_decimals(source['policy'], source.get('asset_name'))
+
+def reward_row(name, txid, tx_date, tx_time, lovelace, token_quantity, token_decimals=0, asset_quantities=()):
+    """Reward row of a source from its integer amounts, classified by its tx_type.
+
+    ada_amount and token_amount are the amounts scaled by their decimals.
+    """
+    ada_amount = assets.scaled_amount(lovelace, assets.ADA_DECIMALS)
+    token_amount = assets.scaled_amount(token_quantity, token_decimals)
+    return {
+        'source': name,
+        'txid': txid,
+        'tx_date': tx_date,
+        'tx_time': tx_time,
+        'lovelace': lovelace,
+        'token_quantity': token_quantity,
+        'token_decimals': token_decimals,
+        'ada_amount': ada_amount,
+        'token_amount': token_amount,
+        'tx_type': REWARD_SOURCES[name]['tx_type'](ada_amount, token_amount),
+        'assets': list(asset_quantities),
+    }
+
+def resolve_wallet_stake_address(cursor, wallet_address):
+    """stake_address id of the wallet: its own for a stake address, else the one of its payment address."""
+    if is_stake_address(wallet_address):
+        cursor.execute("SELECT id FROM stake_address WHERE view = %s;", (wallet_address,))
+    else:
+        cursor.execute("""
+            SELECT stake_address_id FROM tx_out
+            WHERE address = %s AND stake_address_id IS NOT NULL
+            LIMIT 1;
+        """, (wallet_address,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+WITHDRAWALS_QUERY = """
+SELECT
+    encode(tx.hash, 'hex') AS txid,
+    to_char(block.time, 'YYYY-MM-DD') AS tx_date,
+    to_char(block.time, 'HH24:MI') AS tx_time,
+    withdrawal.amount AS lovelace
+FROM withdrawal
+INNER JOIN tx ON tx.id = withdrawal.tx_id
+INNER JOIN block ON block.id = tx.block_id
+WHERE withdrawal.addr_id = %s
+{block_filters}
+ORDER BY tx.block_id DESC;
+"""
+
+def get_withdrawals(cursor, stake_address_id, start_block=None, end_block=None):
+    """(txid, tx_date, tx_time, lovelace) of every reward withdrawal of a stake address within (start_block, end_block]."""
+    filters, params = block_filters("tx.block_id", start_block, end_block)
+    cursor.execute(WITHDRAWALS_QUERY.format(block_filters=filters), (stake_address_id, *params))
+    return [(txid, tx_date, tx_time, int(lovelace)) for txid, tx_date, tx_time, lovelace in cursor.fetchall()]
+
+WITHDRAWALS_ON_CHAIN_QUERY = """
+SELECT encode(tx.hash, 'hex')
+FROM withdrawal
+INNER JOIN tx ON tx.id = withdrawal.tx_id
+WHERE withdrawal.addr_id = %s
+AND tx.hash = ANY(%s::bytea[]);
+"""
+
+def check_withdrawals(protocols, wallet_address, connection, start_block=None, end_block=None, stored=()):
+    """Reward rows of the withdrawal sources of every protocol, read without scanning the tx history.
+
+    Also returns the txids among stored (withdrawal rewards already in the
+    store) that are no longer withdrawals of the stake address on chain,
+    dropped by a rollback.
+    """
+    rewards = {protocol: [] for protocol in protocols}
+    with connection.cursor() as cursor:
+        stake_address_id = resolve_wallet_stake_address(cursor, wallet_address)
+        if stake_address_id is None:
+            print(f"No stake key found for {wallet_address}, skipping withdrawal sources.")
+            return rewards, set()
+        withdrawals = get_withdrawals(cursor, stake_address_id, start_block, end_block)
+        # Stored ones not read again are either outside the blocks or rolled back; the chain tells them apart
+        missing = set(stored) - {txid for txid, _, _, _ in withdrawals}
+        orphaned = set()
+        if missing:
+            cursor.execute(WITHDRAWALS_ON_CHAIN_QUERY, (stake_address_id, hash_params(missing)))
+            orphaned = missing - {row[0] for row in cursor.fetchall()}
+
+    for protocol in protocols:
+        for name in PROTOCOLS[protocol]['sources']:
+            if source_method(name) == 'withdrawals':
+                rewards[protocol].extend(reward_row(name, txid, tx_date, tx_time, lovelace, 0)
+                                         for txid, tx_date, tx_time, lovelace in withdrawals)
+    return rewards, orphaned
+
+def source_address_sets(protocols):
+    """Sender addresses of every scanned source of the protocols."""
+    return {name: set(read_addresses(source_addresses_file(name)))
+            for protocol in protocols for name in scanned_sources(protocol)}
+
+def claim_transactions(matched, protocols, addresses):
+    """Attribute each matched tx to the first source of each protocol paying to it.
+
+    Returns a dict of source name -> list of (txid, tx_date, tx_time).
+    """
+    claims = {name: [] for name in addresses}
+    for txid, tx_date, tx_time, paying_addresses in matched:
+        for protocol in protocols:
+            for name in scanned_sources(protocol):
+                if paying_addresses & addresses[name]:
+                    claims[name].append((txid, tx_date, tx_time))
+                    break
+    return claims
+
+def claimed_txids(claims, ada_only=False):
+    """Unique txids of the claims, only those of sources with an ADA amount when ada_only."""
+    return list(dict.fromkeys(txid for name, claimed in claims.items()
+                              if not ada_only or REWARD_SOURCES[name]['amount'] != 'token'
+                              for txid, _, _ in claimed))
+
+def build_rewards(protocols, claims, ada_amounts, deltas, registry):
+    """Reward rows of every protocol from the claims and their queried amounts."""
+    rewards = {protocol: [] for protocol in protocols}
+    for protocol in protocols:
+        for name in scanned_sources(protocol):
+            source = REWARD_SOURCES[name]
+            for txid, tx_date, tx_time in claims[name]:
+                lovelace = ada_amounts.get(txid, 0) if source['amount'] != 'token' else 0
+                if source.get('positive_only') and lovelace <= 0:
+                    continue
+                asset_quantities = [(*registry[ident][:2], int(quantity), registry[ident][2])
+                                    for ident, quantity in deltas.get(txid, {}).items() if ident in registry]
+                token_quantity, token_decimals = (source_asset_quantity(name, asset_quantities)
+                                                  if source['amount'] != 'ada' else (0, 0))
+                rewards[protocol].append(reward_row(name, txid, tx_date, tx_time, lovelace, token_quantity,
+                                                    token_decimals, asset_quantities))
+    return rewards
+
+def cache_lookup(cache, query, context, tx_hashes):
+    """(cached {txid: value}, txids left to query) of a query; without a cache every tx is queried."""
+    if cache is None:
+        return {}, tx_hashes
+    return query_cache.lookup(cache, query_cache.query_version(query), context, [hash_key(txid) for txid in tx_hashes])
+
+def cache_results(cache, final, query, context, queried, results, hits):
+    """Cache the results of the queried txs in final, and add the cached hits to the results."""
+    if cache is not None:
+        query_cache.save(cache, query_cache.query_version(query), context, queried, results, final)
+    results.update((txid, value) for txid, value in hits.items() if value is not None)
+    return results
+
+def cached_query(cache, final, query, context, tx_hashes, fetch):
+    """{txid: value} of fetch(tx_hashes), only fetching the txs missing from the query cache when given."""
+    hits, misses = cache_lookup(cache, query, context, tx_hashes)
+    results = fetch(misses) if misses else {}
+    return cache_results(cache, final, query, context, misses, results, hits)
+
+def cache_context(protocols, wallet_address):
+    """Scanned addresses and cache contexts of a scan.
+
+    With the query cache on, txs are matched against the sources of every
+    protocol, so the cached matches are shared by all the protocol folders.
+    """
+    addresses = source_address_sets(protocols)
+    all_addresses = sorted(set().union(*source_address_sets(list(PROTOCOLS)).values()))
+    return addresses, all_addresses, query_cache.context_key(*all_addresses), query_cache.context_key(wallet_address)
+
+def matched_rows(results, transaction_hashes, addresses):
+    """(txid, tx_date, tx_time, paying_addresses) of the cached or fetched matches paying from the addresses."""
+    wanted = set().union(*addresses.values())
+    matched = []
+    for txid in map(hash_key, transaction_hashes):
+        if txid in results and wanted.intersection(results[txid][2]):
+            tx_date, tx_time, paying_addresses = results[txid]
+            matched.append((txid, tx_date, tx_time, set(paying_addresses)))
+    return matched
+
+def delta_values(deltas):
+    """JSON safe form of get_asset_deltas results, for the query cache."""
+    return {txid: {str(ident): str(quantity) for ident, quantity in tx_deltas.items()}
+            for txid, tx_deltas in deltas.items()}
+
+def delta_quantities(deltas):
+    """{txid: {multi_asset.id: quantity}} of cached delta_values."""
+    return {txid: {int(ident): int(quantity) for ident, quantity in tx_deltas.items()}
+            for txid, tx_deltas in deltas.items()}
+
+def scan_batches(cursor, transaction_hashes, protocols, wallet_address, batch_size=BATCH_SIZE, cache=None, final=()):
+    """Generator of (batch, matched txs, reward rows of each protocol), one batch of tx hashes at a time.
+
+    Each batch goes through the match, amount and asset stages before the
+    next one is read, so rewards come out as they are found. With a query
+    cache (see query_cache.open_cache) only the txs it misses are queried,
+    and the results of the txs in final are added to it.
+    """
+    if cache is None:
+        addresses = source_address_sets(protocols)
+        all_addresses = sorted(set().union(*addresses.values()))
+        match_context = wallet_context = None
+    else:
+        addresses, all_addresses, match_context, wallet_context = cache_context(protocols, wallet_address)
+    ada_query = ADA_AMOUNTS_QUERY.format(wallet_filter=wallet_filter(wallet_address))
+    deltas_query = ASSET_DELTAS_QUERY.format(wallet_filter=wallet_filter(wallet_address))
+
+    for batch in packed_hashes.packed(transaction_hashes).chunks(batch_size):
+        with metrics.phase("match"):
+            results = cached_query(cache, final, MATCH_QUERY, match_context, batch, lambda misses: {
+                txid: [tx_date, tx_time, sorted(paying_addresses)] for txid, tx_date, tx_time, paying_addresses
+                in match_transactions(cursor, misses, all_addresses, batch_size)})
+            matched = matched_rows(results, batch, addresses)
+            claims = claim_transactions(matched, protocols, addresses)
+
+        # One ADA query and one per-asset query for the claims of every source
+        with metrics.phase("amounts"):
+            ada_amounts = cached_query(cache, final, ada_query, wallet_context, claimed_txids(claims, ada_only=True),
+                                       lambda misses: get_ada_amounts(cursor, misses, wallet_address, batch_size))
+            deltas = delta_quantities(cached_query(
+                cache, final, deltas_query, wallet_context, claimed_txids(claims),
+                lambda misses: delta_values(get_asset_deltas(cursor, misses, wallet_address, batch_size))))
+        with metrics.phase("assets"):
+            registry = assets.resolve_assets(cursor, {ident for tx_deltas in deltas.values() for ident in tx_deltas})
+        with metrics.phase("build"):
+            rewards = build_rewards(protocols, claims, ada_amounts, deltas, registry)
+        yield batch, len(matched), rewards
+
+def check_addresses(transaction_hashes, protocols, wallet_address, batch_size=BATCH_SIZE, connection=None,
+                    cache=None, final=()):
+    """Scan the wallet txs once and attribute the rewards of every protocol.
+
+    A given connection is reused and left open. The cache and final txs are
+    those of scan_batches. Returns the number of matched txs and the reward
+    rows of each protocol.
+    """
+    total = 0
+    rewards = {protocol: [] for protocol in protocols}
+    if not transaction_hashes:
+        return total, rewards
+
+    own_connection = connection is None
+    if own_connection:
+        connection = database.connect()
+    cursor = connection.cursor()
+
+    try:
+        for _, matched, batch_rewards in scan_batches(cursor, transaction_hashes, protocols, wallet_address,
+                                                      batch_size, cache, final):
+            total += matched
+            for protocol, rows in batch_rewards.items():
+                rewards[protocol].extend(rows)
+    finally:
+        cursor.close()
+        if own_connection:
+            connection.close()
+
+    return total, rewards
+
+def format_reward(reward):
+    """One printable line for a reward row."""
+    source = REWARD_SOURCES[reward['source']]
+    parts = [reward['txid'], f"{reward['tx_date']} {reward['tx_time']}"]
+    if source['amount'] != 'token':
+        parts.append(f"{reward['ada_amount']:>10.6f} ADA")
+    if source['amount'] != 'ada':
+        parts.append(f"{reward['token_amount']:>10.6f} {source['asset']}")
+    parts.append(reward['tx_type'])
+    return " | ".join(parts)
+
+def csv_value(value):
+    """A CSV cell as the original per-protocol scripts wrote it: a zero amount as 0, not 0.0."""
+    return 0 if isinstance(value, float) and value == 0 else value
+
+def save_to_csv(rewards, columns, filename):
+    """Write the reward rows of a protocol with its rewards.csv layout."""
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([header for header, _ in columns])
+        for reward in rewards:
+            writer.writerow([csv_value(reward[key]) for _, key in columns])
+
+def store_batch(db, wallet_address, protocols, tx_hashes, rewards, sinks=()):
+    """Store the reward rows of each protocol, mark the tx_hashes processed for the protocols and pass the rows to the sinks."""
+    with metrics.phase("store"):
+        for protocol in protocols:
+            store.save_rewards(db, wallet_address, protocol, rewards.get(protocol, []), map(hash_key, tx_hashes))
+    for sink in sinks:
+        for protocol in protocols:
+            sink.write(protocol, rewards.get(protocol, []))
+
+def update_rewards(db, wallet_address, protocols, batch_size=BATCH_SIZE, connection=None, connections=None,
+                   cache_filename=query_cache.CACHE_FILENAME, finality_depth=query_cache.FINALITY_DEPTH, sinks=(),
+                   blocks=(None, None)):
+    """Scan the wallet txs not processed yet for the protocols and store their rewards.
+
+    The rewards of each batch are stored, and written to the sinks (see
+    reward_sinks.RewardSink), as soon as it is scanned, so an interrupted run keeps
+    its finished batches. With connections, the scan runs on the async engine
+    over that many connections instead, in one go. The results of txs at
+    least finality_depth blocks deep are kept in the query cache at
+    cache_filename (None to skip it). blocks limits the scan to the txs
+    within (start_block, end_block] (see find_txs.block_range). Returns the
+    scanned hashes, the number of matched txs and the number of new reward
+    rows per protocol; the rows themselves only go to the store and sinks.
+    """
+    # Seed the store from a transactions.csv written before it existed
+    if not store.count_transactions(db, wallet_address):
+        store.import_transactions_csv(db, wallet_address, 'transactions.csv')
+
+    # Protocols paying through plain outputs scan the txs; withdrawal sources take the fast path
+    scan_protocols = [protocol for protocol in protocols if scanned_sources(protocol)]
+    fast_protocols = [protocol for protocol in protocols if len(scanned_sources(protocol)) < len(PROTOCOLS[protocol]['sources'])]
+    tx_hashes = packed_hashes.PackedHashes(store.unprocessed_hashes(db, wallet_address, scan_protocols, *blocks)
+                                           if scan_protocols else (), unique=True)
+
+    use_cache = bool(tx_hashes and cache_filename)
+    own_connection = connection is None and bool((tx_hashes and (not connections or use_cache)) or fast_protocols)
+    if own_connection:
+        connection = database.connect()
+    cache = query_cache.open_cache(cache_filename) if use_cache else None
+
+    total = 0
+    found = {protocol: 0 for protocol in protocols}
+    try:
+        final = set()
+        if cache is not None:
+            with connection.cursor() as cursor:
+                final_block = query_cache.final_block(cursor, finality_depth)
+            if final_block is not None:
+                final = packed_hashes.PackedHashes(store.final_hashes(db, wallet_address, final_block), unique=True)
+
+        if connections and tx_hashes:
+            import rewards_async  # Optional, needs psycopg 3
+            with metrics.phase("async scan"):
+                total, scan_rewards = rewards_async.run_check_addresses(tx_hashes, scan_protocols, wallet_address,
+                                                                        batch_size, connections, cache, final)
+            store_batch(db, wallet_address, scan_protocols, tx_hashes, scan_rewards, sinks)
+            for protocol in scan_protocols:
+                found[protocol] += len(scan_rewards[protocol])
+        elif tx_hashes:
+            scanned = 0
+            started = time.monotonic()
+            with connection.cursor() as cursor:
+                for batch, matched, batch_rewards in scan_batches(cursor, tx_hashes, scan_protocols, wallet_address,
+                                                                  batch_size, cache, final):
+                    store_batch(db, wallet_address, scan_protocols, batch, batch_rewards, sinks)
+                    total += matched
+                    scanned += len(batch)
+                    for protocol in scan_protocols:
+                        found[protocol] += len(batch_rewards[protocol])
+                    metrics.progress("reward_txs", scanned, started)
+
+        if fast_protocols:
+            stored = {protocol: {name: {reward['txid'] for reward in store.get_rewards(db, wallet_address, protocol, name)}
+                                 for name in PROTOCOLS[protocol]['sources']}
+                      for protocol in fast_protocols}
+            stored_withdrawals = {txid for protocol in fast_protocols for name, txids in stored[protocol].items()
+                                  if source_method(name) == 'withdrawals' for txid in txids}
+            with metrics.phase("withdrawals"):
+                withdrawals, orphaned = check_withdrawals(fast_protocols, wallet_address, connection, *blocks,
+                                                          stored=stored_withdrawals)
+            if orphaned:
+                # Withdrawals of rolled back blocks are not in txs, so find_txs' rollback cannot drop them
+                for protocol in fast_protocols:
+                    store.delete_rewards(db, wallet_address, protocol, orphaned)
+                print(f"-> Dropped {len(orphaned)} withdrawal rewards no longer on chain.")
+            new_rewards = {}
+            for protocol, rows in withdrawals.items():
+                # Withdrawals are read in full each time, keep only the ones not stored yet
+                known = set().union(*stored[protocol].values())
+                new_rewards[protocol] = [row for row in rows if row['txid'] not in known]
+                found[protocol] += len(new_rewards[protocol])
+                total += len(new_rewards[protocol])
+            store_batch(db, wallet_address, fast_protocols, [], new_rewards, sinks)
+    finally:
+        if cache is not None:
+            cache.close()
+        if own_connection:
+            connection.close()
+        for sink in sinks:
+            sink.flush()
+
+    return tx_hashes, total, found
+
+def export_rewards(db, wallet_address, protocols, verbose=False, price_history=None):
+    """Write each protocol's stored rewards to its CSV file, printing them when verbose.
+
+    With a price history (see prices.load_prices) the USD price and value at tx
+    time are added to every row.
+    """
+    for protocol in protocols:
+        protocol_rewards = []
+        columns = PROTOCOLS[protocol]['columns'] + (prices.PRICE_COLUMNS if price_history else [])
+        for name in PROTOCOLS[protocol]['sources']:
+            source_rewards = store.get_rewards(db, wallet_address, protocol, name)
+            if price_history:
+                prices.enrich_rewards(source_rewards, price_history, REWARD_SOURCES[name]['asset'])
+            if verbose:
+                print(f"\nMatches for {REWARD_SOURCES[name]['asset']} {describe_source(name)}: {len(source_rewards)}")
+                for reward in source_rewards:
+                    print(format_reward(reward))
+            protocol_rewards.extend(source_rewards)
+
+        # A single protocol keeps the rewards.csv name of its folder
+        filename = 'rewards.csv' if len(protocols) == 1 else f"rewards-{protocol}.csv"
+        save_to_csv(protocol_rewards, columns, filename)
+        assets_filename = 'reward-assets.csv' if len(protocols) == 1 else f"reward-assets-{protocol}.csv"
+        save_to_csv(store.get_reward_assets(db, wallet_address, protocol), ASSET_COLUMNS, assets_filename)
+        if verbose:
+            print(f"\nResults have been saved to {filename} (per-asset amounts in {assets_filename})")
+
+def main(default_protocols=None):
+    parser = argparse.ArgumentParser(description="Attribute protocol rewards for the wallet in wallet.addr.")
+    parser.add_argument('protocols', nargs='*', help=f"protocols to scan (default: all of {', '.join(PROTOCOLS)})")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="tx hashes sent per query")
+    parser.add_argument('--async', dest='connections', type=int, nargs='?', const=ASYNC_CONNECTIONS,
+                        metavar='CONNECTIONS', help="scan on the async engine (psycopg 3) with this many pipelined "
+                                                    f"connections (default {ASYNC_CONNECTIONS})")
+    parser.add_argument('--prices', default=prices.PRICES_FILENAME,
+                        help="timestamp,asset,price (USD) history, CSV or Parquet, adding USD values when it exists")
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help=f"query every tx again instead of reusing {os.path.basename(query_cache.CACHE_FILENAME)}")
+    parser.add_argument('--finality-depth', type=int, default=query_cache.FINALITY_DEPTH,
+                        help="blocks below the tip before a tx's query results are cached")
+    parser.add_argument('--from', dest='start', metavar='PERIOD',
+                        help="only scan the txs from this epoch number or ISO date/time (UTC) on")
+    parser.add_argument('--to', dest='end', metavar='PERIOD',
+                        help="only scan the txs up to the end of this epoch number or ISO date (or up to a date/time)")
+    parser.add_argument('--live', action='append', default=[], metavar='FILE',
+                        help="append each reward to FILE (CSV, or JSON lines for .jsonl) as soon as it is found; repeatable")
+    parser.add_argument('--profile', nargs='?', const=metrics.PROFILE_FILENAME, metavar='FILE',
+                        help=f"append per-phase and per-query timings as JSON lines to FILE (default {metrics.PROFILE_FILENAME})")
+    parser.add_argument('--prometheus', metavar='FILE', help="write run metrics to a Prometheus textfile")
+    args = parser.parse_args()
+
+    protocols = args.protocols or default_protocols or list(PROTOCOLS)
+    unknown = [protocol for protocol in protocols if protocol not in PROTOCOLS]
+    if unknown:
+        parser.error(f"unknown protocols: {', '.join(unknown)}")
+
+    for period in (args.start, args.end):
+        if period:
+            try:
+                parse_period(period)
+            except ValueError:
+                parser.error(f"{period} is neither an epoch number nor an ISO date")
+
+    if args.connections:
+        try:
+            import rewards_async  # Fail early when psycopg 3 is missing
+        except ImportError:
+            parser.error("--async needs psycopg 3 (pip install 'psycopg[binary]')")
+
+    if args.profile or args.prometheus:
+        metrics.enable(args.profile, args.prometheus)
+
+    wallet_address = read_address('wallet.addr')
+    db = store.open_store()
+    sinks = [reward_sinks.RewardSink(filename) for filename in args.live]
+    connection = None
+
+    try:
+        blocks = (None, None)
+        if args.start or args.end:
+            # The periods are resolved to a block id range once, on a connection the scan reuses
+            connection = database.connect()
+            blocks = block_range(connection, db, args.start, args.end)
+            print(f"Blocks {blocks[0] + 1 if blocks[0] else 'genesis'} to {blocks[1] or 'tip'} "
+                  f"for {args.start or 'the start'} to {args.end or 'now'}")
+
+        tx_hashes, total, _ = update_rewards(db, wallet_address, protocols, args.batch_size,
+                                             connection=connection, connections=args.connections,
+                                             cache_filename=query_cache.CACHE_FILENAME if args.cache else None,
+                                             finality_depth=args.finality_depth, sinks=sinks, blocks=blocks)
+
+        print(f"Target wallet: {wallet_address}")
+        print(f"New TxIds processed: {len(tx_hashes)} of {store.count_transactions(db, wallet_address)}")
+        print(f"New matches found: {total}")
+
+        price_history = None
+        if os.path.exists(args.prices):
+            try:
+                price_history = prices.load_prices(args.prices)
+                print(f"Prices loaded from {args.prices}: {', '.join(sorted(price_history))}")
+            except (KeyError, RuntimeError, ValueError) as e:
+                print(f"Error reading prices from {args.prices}: {e}")
+
+        with metrics.phase("csv"):
+            export_rewards(db, wallet_address, protocols, verbose=True, price_history=price_history)
+    finally:
+        for sink in sinks:
+            sink.close()
+        if connection is not None:
+            connection.close()
+        db.close()
+        metrics.finish('rewards')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import assets
+import store
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8040
+
+# Encoded responses kept in memory; the least recently used ones are evicted first
+RESPONSE_CACHE_SIZE = 256
+
+# A --from/--to style bound: a prefix of 'YYYY-MM-DD HH:MM:SS' (year, month, day, minute or second)
+PERIOD_PATTERN = re.compile(r"\d{4}(-\d{2}(-\d{2}([ T]\d{2}:\d{2}(:\d{2})?)?)?)?")
+
+# Totals period -> length of its time prefix
+TOTAL_PERIODS = {'year': 4, 'month': 7, 'day': 10}
+
+def open_readonly(filename):
+    """Read-only connection to a store, so the service can never write to it."""
+    return sqlite3.connect(f"file:{os.path.abspath(filename)}?mode=ro", uri=True)
+
+def query_stores(stores, read, key):
+    """Rows read from every store, the ones found in several stores (same key) once."""
+    rows = {}
+    for filename in stores:
+        db = open_readonly(filename)
+        try:
+            for row in read(db):
+                rows.setdefault(key(row), row)
+        finally:
+            db.close()
+    return list(rows.values())
+
+def stores_version(stores):
+    """Data version of every store; it changes with each sync checkpoint or stored rewards batch."""
+    versions = []
+    for filename in stores:
+        db = open_readonly(filename)
+        try:
+            versions.append(store.data_version(db))
+        finally:
+            db.close()
+    return tuple(versions)
+
+def query_params(query, allowed):
+    """Sorted (name, value) pairs of a query string, checked against the endpoint's parameters."""
+    params = {}
+    for name, values in parse_qs(query).items():
+        if name not in allowed:
+            raise ValueError(f"unknown parameter {name} (expected {', '.join(allowed) or 'none'})")
+        if len(values) > 1:
+            raise ValueError(f"{name} given more than once")
+        value = values[0]
+        if name in ('from', 'to'):
+            if not PERIOD_PATTERN.fullmatch(value):
+                raise ValueError(f"{name}={value} is not a YYYY[-MM[-DD[THH:MM[:SS]]]] period")
+            value = value.replace('T', ' ')
+        elif name == 'period' and value not in TOTAL_PERIODS:
+            raise ValueError(f"period must be one of {', '.join(TOTAL_PERIODS)}")
+        params[name] = value
+    return tuple(sorted(params.items()))
+
+def list_wallets(stores, params):
+    wallets = query_stores(stores, store.wallet_summaries, key=lambda row: row[0])
+    return {'wallets': [{'wallet': wallet, 'txs': txs, 'latest_block': latest_block, 'checkpoint': checkpoint,
+                         'synced_at': synced_at}
+                        for wallet, txs, latest_block, checkpoint, synced_at in sorted(wallets)]}
+
+def list_transactions(stores, params):
+    rows = query_stores(stores, lambda db: store.find_transactions(db, params.get('wallet'), params.get('from'),
+                                                                   params.get('to')),
+                        key=lambda row: row[:2])
+    rows.sort(key=lambda row: (row[2], row[1], row[0]))
+    return {'count': len(rows),
+            'transactions': [{'wallet': wallet, 'tx_hash': tx_hash, 'block_id': block_id, 'time': block_time}
+                             for wallet, tx_hash, block_id, block_time in rows]}
+
+def reward_rows(stores, params):
+    """Reward rows matching the filters, oldest first, each with its [policy, asset, quantity, amount] list."""
+    filters = (params.get('wallet'), params.get('protocol'), params.get('from'), params.get('to'))
+    rows = query_stores(stores, lambda db: store.find_rewards(db, *filters), key=lambda row: row[:2] + row[3:4])
+    asset_rows = query_stores(stores, lambda db: store.find_reward_assets(db, *filters), key=lambda row: row[:5])
+    quantities = {}
+    for wallet, protocol, tx_hash, policy, asset, quantity, decimals in asset_rows:
+        quantities.setdefault((wallet, protocol, tx_hash), []).append(
+            [policy, asset, int(quantity), assets.scaled_amount(quantity, decimals)])
+    rows.sort(key=lambda row: (row[5], row[3], row[1], row[0]))
+    return [(*row, sorted(quantities.get((row[0], row[1], row[3]), []))) for row in rows]
+
+def list_rewards(stores, params):
+    rows = reward_rows(stores, params)
+    return {'count': len(rows),
+            'rewards': [{'wallet': wallet, 'protocol': protocol, 'source': source, 'txid': tx_hash,
+                         'block_id': block_id, 'time': reward_time, 'lovelace': lovelace,
+                         'ada_amount': assets.scaled_amount(lovelace, assets.ADA_DECIMALS),
+                         'token_quantity': int(token_quantity),
+                         'token_amount': assets.scaled_amount(token_quantity, token_decimals),
+                         'tx_type': tx_type, 'assets': asset_quantities}
+                        for (wallet, protocol, source, tx_hash, block_id, reward_time, lovelace, token_quantity,
+                             token_decimals, tx_type, asset_quantities) in rows]}
+
+def reward_totals(stores, params):
+    period = params.get('period', 'month')
+    # Integer sums, scaled once per total
+    totals = {}
+    for row in reward_rows(stores, params):
+        _, protocol, source, _, _, reward_time, lovelace, token_quantity, token_decimals, _, _ = row
+        total = totals.setdefault((reward_time[:TOTAL_PERIODS[period]], protocol, source), [0, 0, 0, token_decimals])
+        total[0] += 1
+        total[1] += lovelace
+        total[2] += int(token_quantity)
+    return {'period': period,
+            'totals': [{'period': key, 'protocol': protocol, 'source': source, 'rewards': count,
+                        'lovelace': lovelace, 'ada_amount': assets.scaled_amount(lovelace, assets.ADA_DECIMALS),
+                        'token_quantity': token_quantity,
+                        'token_amount': assets.scaled_amount(token_quantity, token_decimals)}
+                       for (key, protocol, source), (count, lovelace, token_quantity, token_decimals)
+                       in sorted(totals.items())]}
+
+# Path -> (handler, accepted query parameters)
+ENDPOINTS = {
+    '/wallets': (list_wallets, ()),
+    '/transactions': (list_transactions, ('wallet', 'from', 'to')),
+    '/rewards': (list_rewards, ('wallet', 'protocol', 'from', 'to')),
+    '/totals': (reward_totals, ('wallet', 'protocol', 'from', 'to', 'period')),
+}
+
+class ResponseCache:
+    """LRU of (etag, body) responses, emptied whenever the stores' data version changes."""
+
+    def __init__(self, size=RESPONSE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, version, key, entry):
+        with self._lock:
+            # A response computed while a sync landed is not kept for the new version
+            if version != self._version or self.size <= 0:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Read-only JSON endpoints over the tracker stores of the server."""
+
+    server_version = "tracker-serve"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        path = url.path.rstrip('/')
+        if path not in ENDPOINTS:
+            self.send_json(HTTPStatus.NOT_FOUND, {'error': f"unknown path, expected one of {', '.join(ENDPOINTS)}"})
+            return
+        handler, allowed = ENDPOINTS[path]
+        try:
+            params = query_params(url.query, allowed)
+        except ValueError as e:
+            self.send_json(HTTPStatus.BAD_REQUEST, {'error': str(e)})
+            return
+
+        try:
+            version = stores_version(self.server.stores)
+            key = (path, params)
+            entry = self.server.cache.get(version, key)
+            if entry is None:
+                body = json.dumps(handler(self.server.stores, dict(params)), separators=(',', ':')).encode()
+                entry = (f'"{hashlib.md5(body).hexdigest()}"', body)
+                self.server.cache.put(version, key, entry)
+        except sqlite3.Error as e:
+            self.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': f"store unreadable: {e}"})
+            return
+
+        etag, body = entry
+        if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_body(HTTPStatus.OK, body, etag)
+
+    def send_json(self, status, value):
+        self.send_body(status, json.dumps(value).encode())
+
+    def send_body(self, status, body, etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            # Clients revalidate every time; unchanged data costs a 304
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+def make_server(stores, host=DEFAULT_HOST, port=DEFAULT_PORT, cache_size=RESPONSE_CACHE_SIZE):
+    """Threaded HTTP server answering from the stores."""
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.stores = stores
+    server.cache = ResponseCache(cache_size)
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the tracker's stored txs and rewards over local HTTP, without touching dbsync.")
+    parser.add_argument('stores', nargs='*', help="tracker.db files to serve (default: every one found in the repository)")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"address to listen on (default {DEFAULT_HOST})")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"port to listen on (default {DEFAULT_PORT})")
+    parser.add_argument('--cache-size', type=int, default=RESPONSE_CACHE_SIZE,
+                        help=f"responses kept in memory (default {RESPONSE_CACHE_SIZE}, 0 to disable)")
+    args = parser.parse_args()
+
+    stores = args.stores or store.find_stores(REPO_DIR)
+    if not stores:
+        print("Error: no tracker.db found, run find_txs.py and a rewards.py first.")
+        return
+    missing = [filename for filename in stores if not os.path.exists(filename)]
+    if missing:
+        print(f"Error: {', '.join(missing)} not found.")
+        return
+
+    try:
+        server = make_server(stores, args.host, args.port, args.cache_size)
+    except OSError as e:
+        print(f"Error: cannot listen on {args.host}:{args.port}: {e}")
+        return
+    print(f"Serving {', '.join(stores)} on http://{args.host}:{args.port} ({', '.join(ENDPOINTS)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
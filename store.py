@@ -0,0 +1,512 @@
+import csv
+import glob
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+import assets
+
+# Default location of the local store, next to transactions.csv
+STORE_FILENAME = "tracker.db"
+
+# Amounts are kept as integer lovelace and on-chain quantities with their
+# decimals. Quantities have no column type so the ones past 64 bits can be
+# kept exactly as text (see db_quantity).
+REWARD_TABLES = """
+CREATE TABLE IF NOT EXISTS rewards (
+    wallet TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    source TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    tx_date TEXT NOT NULL,
+    tx_time TEXT NOT NULL,
+    lovelace INTEGER NOT NULL,
+    token_quantity NOT NULL,
+    token_decimals INTEGER NOT NULL,
+    tx_type TEXT NOT NULL,
+    PRIMARY KEY (wallet, protocol, tx_hash)
+);
+
+CREATE TABLE IF NOT EXISTS reward_assets (
+    wallet TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    policy TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    quantity NOT NULL,
+    decimals INTEGER NOT NULL,
+    PRIMARY KEY (wallet, protocol, tx_hash, policy, asset)
+);
+"""
+
+SCHEMA = REWARD_TABLES + """
+CREATE TABLE IF NOT EXISTS txs (
+    wallet TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    block_id INTEGER NOT NULL,
+    block_time TEXT NOT NULL,
+    PRIMARY KEY (wallet, tx_hash)
+);
+CREATE INDEX IF NOT EXISTS txs_wallet_block ON txs (wallet, block_id);
+
+CREATE TABLE IF NOT EXISTS processed (
+    wallet TEXT NOT NULL,
+    protocol TEXT NOT NULL,
+    tx_hash TEXT NOT NULL,
+    PRIMARY KEY (wallet, protocol, tx_hash)
+);
+
+CREATE TABLE IF NOT EXISTS checkpoints (
+    wallet TEXT PRIMARY KEY,
+    block_id INTEGER NOT NULL,
+    updated_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS windows (
+    wallet TEXT NOT NULL,
+    start_block INTEGER NOT NULL,
+    end_block INTEGER NOT NULL,
+    done INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (wallet, start_block)
+);
+
+CREATE TABLE IF NOT EXISTS block_bounds (
+    bound TEXT PRIMARY KEY,
+    block_id INTEGER NOT NULL
+);
+"""
+
+# Schema changes applied in order to older stores, tracked in PRAGMA user_version
+MIGRATIONS = [
+    # 1: block hash and slot of the checkpoint block, to detect chain rollbacks
+    """
+    ALTER TABLE checkpoints ADD COLUMN block_hash TEXT;
+    ALTER TABLE checkpoints ADD COLUMN slot_no INTEGER;
+    """,
+    # 2: integer reward amounts; the old REAL ones cannot be turned back into
+    # exact quantities, so the rewards are dropped and rescanned on the next run
+    f"""
+    DROP TABLE rewards;
+    DROP TABLE reward_assets;
+    DELETE FROM processed;
+    {REWARD_TABLES}
+    """,
+]
+
+def _migrate(db):
+    version = db.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+        db.executescript(f"BEGIN; {migration} PRAGMA user_version = {number}; COMMIT;")
+
+def find_stores(repo_dir):
+    """tracker.db of the current folder, the repository root and every protocol folder that has one."""
+    candidates = [STORE_FILENAME, os.path.join(repo_dir, STORE_FILENAME),
+                  *sorted(glob.glob(os.path.join(repo_dir, '*', STORE_FILENAME)))]
+    stores = {}
+    for filename in candidates:
+        if os.path.exists(filename):
+            stores.setdefault(os.path.realpath(filename), filename)
+    return list(stores.values())
+
+def open_store(filename=STORE_FILENAME):
+    """Open (and create if needed) the local SQLite store."""
+    db = sqlite3.connect(filename)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.executescript(SCHEMA)
+    _migrate(db)
+    return db
+
+def get_checkpoint(db, wallet):
+    """Highest block_id synced for the wallet, or None."""
+    row = db.execute("SELECT block_id FROM checkpoints WHERE wallet = ?", (wallet,)).fetchone()
+    return row[0] if row else None
+
+def _write_checkpoint(db, wallet, block_id):
+    # The recorded block hash only stays while the checkpoint stays on its block
+    db.execute("""
+        INSERT INTO checkpoints (wallet, block_id, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT (wallet) DO UPDATE SET
+            block_id = MAX(block_id, excluded.block_id),
+            block_hash = CASE WHEN excluded.block_id > block_id THEN NULL ELSE block_hash END,
+            slot_no = CASE WHEN excluded.block_id > block_id THEN NULL ELSE slot_no END,
+            updated_at = excluded.updated_at
+    """, (wallet, block_id, datetime.now(timezone.utc).isoformat()))
+
+def set_checkpoint(db, wallet, block_id):
+    """Advance the wallet checkpoint to block_id; it never moves backwards."""
+    with db:
+        _write_checkpoint(db, wallet, block_id)
+
+def get_checkpoint_block(db, wallet):
+    """(block_id, block_hash, slot_no) of the wallet checkpoint, or None. The hash is None until recorded."""
+    return db.execute("SELECT block_id, block_hash, slot_no FROM checkpoints WHERE wallet = ?", (wallet,)).fetchone()
+
+def record_checkpoint_block(db, wallet, block_id, block_hash, slot_no):
+    """Record the hash and slot of the checkpoint block, if the checkpoint is still on block_id."""
+    with db:
+        db.execute("""
+            UPDATE checkpoints SET block_hash = ?, slot_no = ?
+            WHERE wallet = ? AND block_id = ?
+        """, (block_hash, slot_no, wallet, block_id))
+
+def recent_transactions(db, wallet, limit, before_block=None):
+    """(tx_hash, block_id) of the wallet's latest stored txs below before_block, newest first."""
+    return db.execute("""
+        SELECT tx_hash, block_id FROM txs
+        WHERE wallet = ? AND block_id < COALESCE(?, block_id + 1)
+        ORDER BY block_id DESC
+        LIMIT ?
+    """, (wallet, before_block, limit)).fetchall()
+
+def rollback(db, wallet, block_id):
+    """Drop the wallet's txs (and their rewards) after block_id and move the checkpoint back to it.
+
+    Returns the number of orphaned txs dropped.
+    """
+    with db:
+        orphaned = [row[0] for row in db.execute(
+            "SELECT tx_hash FROM txs WHERE wallet = ? AND block_id > ?", (wallet, block_id))]
+        db.executemany("DELETE FROM rewards WHERE wallet = ? AND tx_hash = ?", [(wallet, tx_hash) for tx_hash in orphaned])
+        db.executemany("DELETE FROM reward_assets WHERE wallet = ? AND tx_hash = ?", [(wallet, tx_hash) for tx_hash in orphaned])
+        db.executemany("DELETE FROM processed WHERE wallet = ? AND tx_hash = ?", [(wallet, tx_hash) for tx_hash in orphaned])
+        db.execute("DELETE FROM txs WHERE wallet = ? AND block_id > ?", (wallet, block_id))
+        db.execute("DELETE FROM windows WHERE wallet = ?", (wallet,))
+        db.execute("""
+            UPDATE checkpoints SET block_id = ?, block_hash = NULL, slot_no = NULL, updated_at = ?
+            WHERE wallet = ?
+        """, (block_id, datetime.now(timezone.utc).isoformat(), wallet))
+    return len(orphaned)
+
+def save_transactions(db, wallet, transactions, checkpoint=None):
+    """Insert (tx_hash, block_id, block_time) rows and advance the wallet checkpoint.
+
+    The checkpoint defaults to the highest block_id of the rows. Returns the
+    number of txs that were not stored yet.
+    """
+    rows = [(wallet, tx_hash, int(block_id), str(block_time)) for tx_hash, block_id, block_time in transactions]
+    if not rows:
+        return 0
+    with db:
+        before = db.total_changes
+        db.executemany("INSERT OR IGNORE INTO txs (wallet, tx_hash, block_id, block_time) VALUES (?, ?, ?, ?)", rows)
+        inserted = db.total_changes - before
+        _write_checkpoint(db, wallet, checkpoint if checkpoint is not None else max(row[2] for row in rows))
+    return inserted
+
+def add_transactions(db, wallet, transactions):
+    """Insert (tx_hash, block_id, block_time) rows of a period without moving the wallet checkpoint.
+
+    Returns the number of txs that were not stored yet.
+    """
+    with db:
+        before = db.total_changes
+        db.executemany("INSERT OR IGNORE INTO txs (wallet, tx_hash, block_id, block_time) VALUES (?, ?, ?, ?)",
+                       [(wallet, tx_hash, int(block_id), str(block_time)) for tx_hash, block_id, block_time in transactions])
+        return db.total_changes - before
+
+def get_block_bound(db, bound):
+    """Block id stored for a period bound (see find_txs.block_bound), or None."""
+    row = db.execute("SELECT block_id FROM block_bounds WHERE bound = ?", (bound,)).fetchone()
+    return row[0] if row else None
+
+def save_block_bound(db, bound, block_id):
+    """Keep the block id of a settled period bound."""
+    with db:
+        db.execute("INSERT OR REPLACE INTO block_bounds (bound, block_id) VALUES (?, ?)", (bound, block_id))
+
+def plan_windows(db, wallet, start_block, end_block, size):
+    """Split the (start_block, end_block] scan into block windows of the given size.
+
+    An unfinished plan already stored for the wallet is kept as is, so an
+    interrupted scan resumes with the same windows. Returns the pending
+    (start_block, end_block) windows, oldest first.
+    """
+    with db:
+        if not db.execute("SELECT 1 FROM windows WHERE wallet = ? LIMIT 1", (wallet,)).fetchone():
+            db.executemany("INSERT INTO windows (wallet, start_block, end_block) VALUES (?, ?, ?)",
+                           [(wallet, start, min(start + size, end_block))
+                            for start in range(start_block, end_block, size)])
+    return pending_windows(db, wallet)
+
+def pending_windows(db, wallet):
+    """(start_block, end_block) of the wallet's windows not scanned yet, oldest first."""
+    return db.execute("""
+        SELECT start_block, end_block FROM windows
+        WHERE wallet = ? AND done = 0
+        ORDER BY start_block
+    """, (wallet,)).fetchall()
+
+def save_window(db, wallet, start_block, end_block, transactions):
+    """Store the txs of a finished window and mark it done, in one transaction.
+
+    The wallet checkpoint advances over the windows finished without a gap from
+    the start of the plan; the plan is dropped once every window is done.
+    """
+    rows = [(wallet, tx_hash, int(block_id), str(block_time)) for tx_hash, block_id, block_time in transactions]
+    with db:
+        db.executemany("INSERT OR IGNORE INTO txs (wallet, tx_hash, block_id, block_time) VALUES (?, ?, ?, ?)", rows)
+        db.execute("UPDATE windows SET done = 1 WHERE wallet = ? AND start_block = ?", (wallet, start_block))
+        first_start, first_pending, last_end = db.execute("""
+            SELECT MIN(start_block), MIN(CASE WHEN done = 0 THEN start_block END), MAX(end_block)
+            FROM windows WHERE wallet = ?
+        """, (wallet,)).fetchone()
+        if first_pending is None:
+            _write_checkpoint(db, wallet, last_end)
+            db.execute("DELETE FROM windows WHERE wallet = ?", (wallet,))
+        elif first_pending > first_start:
+            _write_checkpoint(db, wallet, first_pending)
+    return len(rows)
+
+def count_transactions(db, wallet):
+    """Number of txs stored for the wallet."""
+    return db.execute("SELECT COUNT(*) FROM txs WHERE wallet = ?", (wallet,)).fetchone()[0]
+
+def latest_transaction(db, wallet):
+    """(tx_hash, block_id, block_time) of the wallet's latest stored tx, or None."""
+    return db.execute("""
+        SELECT tx_hash, block_id, block_time FROM txs
+        WHERE wallet = ?
+        ORDER BY block_id DESC
+        LIMIT 1
+    """, (wallet,)).fetchone()
+
+def import_transactions_csv(db, wallet, filename):
+    """Load an existing transactions.csv into the store. Returns the rows imported."""
+    try:
+        with open(filename, mode='r', newline='') as file:
+            reader = csv.reader(file)
+            next(reader, None)  # Skip header
+            rows = [row[:3] for row in reader if len(row) >= 3 and row[1].isdigit()]
+    except FileNotFoundError:
+        return 0
+    return save_transactions(db, wallet, rows)
+
+def export_transactions_csv(db, wallet, filename):
+    """Write the wallet's stored txs to a transactions.csv file, newest first."""
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['tx_hash', 'block_id', 'timestamp'])
+        writer.writerows(db.execute("""
+            SELECT tx_hash, block_id, block_time FROM txs
+            WHERE wallet = ?
+            ORDER BY block_id DESC
+        """, (wallet,)))
+
+def final_hashes(db, wallet, block_id):
+    """Iterator of the hex hashes of the wallet's txs at or below block_id, in hash order."""
+    return (row[0] for row in db.execute("SELECT tx_hash FROM txs WHERE wallet = ? AND block_id <= ? ORDER BY tx_hash",
+                                         (wallet, block_id)))
+
+def unprocessed_hashes(db, wallet, protocols, start_block=None, end_block=None):
+    """Iterator of the hex hashes of the wallet's txs not yet processed for all of the protocols, newest first.
+
+    Only the txs within blocks (start_block, end_block] when given.
+    """
+    placeholders = ", ".join("?" for _ in protocols)
+    return (row[0] for row in db.execute(f"""
+        SELECT tx_hash FROM txs
+        WHERE wallet = ?
+        AND block_id > COALESCE(?, -1) AND block_id <= COALESCE(?, block_id)
+        AND (SELECT COUNT(*) FROM processed
+             WHERE processed.wallet = txs.wallet
+             AND processed.tx_hash = txs.tx_hash
+             AND processed.protocol IN ({placeholders})) < ?
+        ORDER BY block_id DESC
+    """, (wallet, start_block, end_block, *protocols, len(protocols))))
+
+def db_quantity(quantity):
+    """A quantity as stored: an integer, or its decimal text when it does not fit in 64 bits."""
+    return quantity if -2 ** 63 <= quantity < 2 ** 63 else str(quantity)
+
+def save_rewards(db, wallet, protocol, rewards, tx_hashes):
+    """Store a protocol's reward rows with their per-asset amounts and mark the scanned tx_hashes as processed."""
+    with db:
+        db.executemany("DELETE FROM reward_assets WHERE wallet = ? AND protocol = ? AND tx_hash = ?",
+                       [(wallet, protocol, reward['txid']) for reward in rewards])
+        db.executemany("""
+            INSERT INTO reward_assets (wallet, protocol, tx_hash, policy, asset, quantity, decimals)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(wallet, protocol, reward['txid'], policy, asset, db_quantity(quantity), decimals)
+              for reward in rewards for policy, asset, quantity, decimals in reward.get('assets', ())])
+        db.executemany("""
+            INSERT OR REPLACE INTO rewards
+                (wallet, protocol, source, tx_hash, tx_date, tx_time, lovelace, token_quantity, token_decimals, tx_type)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(wallet, protocol, reward['source'], reward['txid'], reward['tx_date'], reward['tx_time'],
+               reward['lovelace'], db_quantity(reward['token_quantity']), reward['token_decimals'], reward['tx_type'])
+              for reward in rewards])
+        db.executemany("INSERT OR IGNORE INTO processed (wallet, protocol, tx_hash) VALUES (?, ?, ?)",
+                       [(wallet, protocol, tx_hash) for tx_hash in tx_hashes])
+
+def delete_rewards(db, wallet, protocol, tx_hashes):
+    """Drop a protocol's reward rows, per-asset amounts and processed marks of the tx_hashes."""
+    params = [(wallet, protocol, tx_hash) for tx_hash in tx_hashes]
+    with db:
+        for table in ('rewards', 'reward_assets', 'processed'):
+            db.executemany(f"DELETE FROM {table} WHERE wallet = ? AND protocol = ? AND tx_hash = ?", params)
+
+def get_rewards(db, wallet, protocol, source):
+    """Stored reward rows of one source, newest first, with their ada_amount and token_amount scaled by decimals."""
+    db.row_factory = sqlite3.Row
+    try:
+        rows = db.execute("""
+            SELECT rewards.source, rewards.tx_hash AS txid, rewards.tx_date, rewards.tx_time,
+                rewards.lovelace, rewards.token_quantity, rewards.token_decimals, rewards.tx_type
+            FROM rewards
+            LEFT JOIN txs ON txs.wallet = rewards.wallet AND txs.tx_hash = rewards.tx_hash
+            WHERE rewards.wallet = ? AND rewards.protocol = ? AND rewards.source = ?
+            ORDER BY txs.block_id DESC, rewards.tx_date DESC, rewards.tx_time DESC
+        """, (wallet, protocol, source)).fetchall()
+    finally:
+        db.row_factory = None
+    rewards = []
+    for row in rows:
+        reward = dict(row)
+        reward['token_quantity'] = int(reward['token_quantity'])
+        reward['ada_amount'] = assets.scaled_amount(reward['lovelace'], assets.ADA_DECIMALS)
+        reward['token_amount'] = assets.scaled_amount(reward['token_quantity'], reward['token_decimals'])
+        rewards.append(reward)
+    return rewards
+
+def get_reward_assets(db, wallet, protocol):
+    """Stored per-asset quantities of a protocol's rewards, newest first, with their amount scaled by decimals."""
+    db.row_factory = sqlite3.Row
+    try:
+        rows = db.execute("""
+            SELECT reward_assets.tx_hash AS txid, rewards.tx_date, reward_assets.policy,
+                reward_assets.asset, reward_assets.quantity, reward_assets.decimals
+            FROM reward_assets
+            JOIN rewards ON rewards.wallet = reward_assets.wallet AND rewards.protocol = reward_assets.protocol
+                AND rewards.tx_hash = reward_assets.tx_hash
+            WHERE reward_assets.wallet = ? AND reward_assets.protocol = ?
+            ORDER BY rewards.tx_date DESC, rewards.tx_time DESC, reward_assets.asset
+        """, (wallet, protocol)).fetchall()
+    finally:
+        db.row_factory = None
+    asset_rows = []
+    for row in rows:
+        asset_row = dict(row)
+        asset_row['quantity'] = int(asset_row['quantity'])
+        asset_row['amount'] = assets.scaled_amount(asset_row['quantity'], asset_row.pop('decimals'))
+        asset_rows.append(asset_row)
+    return asset_rows
+
+def all_transactions(db):
+    """Cursor of (wallet, tx_hash, block_id, block_time) over every stored tx, block_time cut to seconds."""
+    return db.execute("""
+        SELECT wallet, tx_hash, block_id, substr(block_time, 1, 19)
+        FROM txs
+        ORDER BY wallet, block_id
+    """)
+
+def all_rewards(db):
+    """Cursor of (wallet, protocol, source, tx_hash, block_id, time, lovelace, token_quantity, tx_type) over every reward.
+
+    The time is the tx's block time, or its tx_date and tx_time when the tx is not stored (withdrawals).
+    """
+    return db.execute("""
+        SELECT rewards.wallet, rewards.protocol, rewards.source, rewards.tx_hash, txs.block_id,
+            COALESCE(substr(txs.block_time, 1, 19), rewards.tx_date || ' ' || rewards.tx_time || ':00'),
+            rewards.lovelace, rewards.token_quantity, rewards.tx_type
+        FROM rewards
+        LEFT JOIN txs ON txs.wallet = rewards.wallet AND txs.tx_hash = rewards.tx_hash
+        ORDER BY rewards.wallet, rewards.protocol
+    """)
+
+def all_reward_assets(db):
+    """Cursor of (wallet, protocol, tx_hash, time, policy, asset, quantity) over every per-asset reward quantity."""
+    return db.execute("""
+        SELECT reward_assets.wallet, reward_assets.protocol, reward_assets.tx_hash,
+            COALESCE(substr(txs.block_time, 1, 19), rewards.tx_date || ' ' || rewards.tx_time || ':00'),
+            reward_assets.policy, reward_assets.asset, reward_assets.quantity
+        FROM reward_assets
+        JOIN rewards ON rewards.wallet = reward_assets.wallet AND rewards.protocol = reward_assets.protocol
+            AND rewards.tx_hash = reward_assets.tx_hash
+        LEFT JOIN txs ON txs.wallet = reward_assets.wallet AND txs.tx_hash = reward_assets.tx_hash
+        ORDER BY reward_assets.wallet, reward_assets.protocol
+    """)
+
+# Time of a reward: its tx's block time, or its own date and time when the tx is not stored (withdrawals)
+REWARD_TIME = "COALESCE(substr(txs.block_time, 1, 19), rewards.tx_date || ' ' || rewards.tx_time || ':00')"
+
+def _period_filters(time_column, start=None, end=None):
+    """SQL conditions and parameters keeping the times within start and end.
+
+    Both are prefixes of 'YYYY-MM-DD HH:MM:SS'; end is inclusive at its own
+    precision, so '2024-03' keeps all of March.
+    """
+    conditions, params = [], []
+    if start:
+        conditions.append(f"{time_column} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"substr({time_column}, 1, {len(end)}) <= ?")
+        params.append(end)
+    return conditions, params
+
+def _where(conditions):
+    return f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+def _reward_filters(wallet, protocol, start, end):
+    conditions, params = _period_filters(REWARD_TIME, start, end)
+    for column, value in (("rewards.protocol", protocol), ("rewards.wallet", wallet)):
+        if value:
+            conditions.insert(0, f"{column} = ?")
+            params.insert(0, value)
+    return conditions, params
+
+def data_version(db):
+    """Token that changes whenever a sync moves a checkpoint or stores txs, or a rewards run stores results."""
+    return db.execute("""
+        SELECT (SELECT COUNT(*) FROM checkpoints), (SELECT MAX(updated_at) FROM checkpoints),
+            (SELECT MAX(rowid) FROM txs), (SELECT MAX(rowid) FROM processed), (SELECT MAX(rowid) FROM rewards)
+    """).fetchone()
+
+def wallet_summaries(db):
+    """(wallet, txs, latest tx block_id, checkpoint block_id, checkpoint updated_at) of every stored wallet."""
+    return db.execute("""
+        SELECT txs.wallet, COUNT(*), MAX(txs.block_id), checkpoints.block_id, checkpoints.updated_at
+        FROM txs
+        LEFT JOIN checkpoints ON checkpoints.wallet = txs.wallet
+        GROUP BY txs.wallet
+        ORDER BY txs.wallet
+    """).fetchall()
+
+def find_transactions(db, wallet=None, start=None, end=None):
+    """(wallet, tx_hash, block_id, block_time) of the stored txs of a wallet (or all) within a period, oldest first."""
+    conditions, params = _period_filters("substr(block_time, 1, 19)", start, end)
+    if wallet:
+        conditions.insert(0, "wallet = ?")
+        params.insert(0, wallet)
+    return db.execute(f"""
+        SELECT wallet, tx_hash, block_id, substr(block_time, 1, 19)
+        FROM txs
+        {_where(conditions)}
+        ORDER BY block_id, tx_hash
+    """, params).fetchall()
+
+def find_rewards(db, wallet=None, protocol=None, start=None, end=None):
+    """Reward rows (wallet, protocol, source, tx_hash, block_id, time, lovelace, token_quantity, token_decimals,
+    tx_type) of a wallet and protocol (or all) within a period, oldest first."""
+    conditions, params = _reward_filters(wallet, protocol, start, end)
+    return db.execute(f"""
+        SELECT rewards.wallet, rewards.protocol, rewards.source, rewards.tx_hash, txs.block_id, {REWARD_TIME},
+            rewards.lovelace, rewards.token_quantity, rewards.token_decimals, rewards.tx_type
+        FROM rewards
+        LEFT JOIN txs ON txs.wallet = rewards.wallet AND txs.tx_hash = rewards.tx_hash
+        {_where(conditions)}
+        ORDER BY {REWARD_TIME}, rewards.tx_hash, rewards.protocol
+    """, params).fetchall()
+
+def find_reward_assets(db, wallet=None, protocol=None, start=None, end=None):
+    """(wallet, protocol, tx_hash, policy, asset, quantity, decimals) of the rewards find_rewards returns."""
+    conditions, params = _reward_filters(wallet, protocol, start, end)
+    return db.execute(f"""
+        SELECT reward_assets.wallet, reward_assets.protocol, reward_assets.tx_hash,
+            reward_assets.policy, reward_assets.asset, reward_assets.quantity, reward_assets.decimals
+        FROM reward_assets
+        JOIN rewards ON rewards.wallet = reward_assets.wallet AND rewards.protocol = reward_assets.protocol
+            AND rewards.tx_hash = reward_assets.tx_hash
+        LEFT JOIN txs ON txs.wallet = rewards.wallet AND txs.tx_hash = rewards.tx_hash
+        {_where(conditions)}
+    """, params).fetchall()